@@ -7,6 +7,7 @@
 # };
 import io
 import struct
+from collections import OrderedDict
 from enum import IntEnum
 from typing import List
 from pprint import pformat
@@ -14,6 +15,11 @@ from pprint import pformat
 from math import sqrt
 
 import cstruct
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only required by array mode (FaceTable)
+    np = None
 
 HEADER_LUMPS    = 64
 SURF_LIGHT      = 0x1            #value will hold the light strength
@@ -72,6 +78,23 @@ class LUMP_ENUM(IntEnum):
     LUMP_LEAFWATERDATA =                    36
     LUMP_TEXDATA_STRING_DATA =              43
     LUMP_TEXDATA_STRING_TABLE =             44
+class Record:
+    """
+    Base for small record classes that are created in huge numbers.
+    Fields are declared in __slots__, so instances don't carry per instance __dict__.
+    """
+    __slots__ = ()
+
+    def _asdict(self):
+        return OrderedDict((name,getattr(self,name)) for name in self.__slots__)
+
+    def __str__(self):
+        return '{}({})'.format(type(self).__name__,', '.join('{}={!r}'.format(name,getattr(self,name)) for name in self.__slots__))
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class dheader_t:
     def __init__(self):
         self.ident = ''
@@ -117,20 +140,16 @@ class lump_t:
 # };
 
 
-class dplane_t:
+class dplane_t(Record):
+    __slots__ = ('normal','dist','type')
     size = 20
+    dtype = [('normal','<f4',(3,)),('dist','<f4'),('type','<i4')]
 
     def __init__(self):
         self.normal = Vector()
         self.dist = 0.0
         self.type = 0
 
-    def __str__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
 
 #
 # struct Vector
@@ -139,21 +158,16 @@ class dplane_t:
 #     float y;
 #     float z;
 # };
-class Vector:
+class Vector(Record):
+    __slots__ = ('x','y','z')
     size = 12
+    dtype = ('<f4',(3,))
 
     def __init__(self):
         self.x = 0
         self.y = 0
         self.z = 0
 
-    def __str__(self):
-        
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
     def gen(self,data):
         self.x = round(struct.unpack('f',data.read(4))[0],15)
         self.y = round(struct.unpack('f',data.read(4))[0],15)
@@ -166,31 +180,23 @@ class Vector:
 # {
 # 	unsigned short	v[2];	// vertex indices
 # };
-class dedge_t:
+class dedge_t(Record):
+    __slots__ = ('v',)
     size = 4
+    dtype = ('<u2',(2,))
 
     def __init__(self):
         self.v = []  # type: List[int]
 
-    def __str__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
 
-class Surfedge:
+class Surfedge(Record):
+    __slots__ = ('surfedge',)
     size = 4
+    dtype = '<i4'
 
     def __init__(self):
         self.surfedge = 0
 
-    def __str__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
 
 class dface_t(cstruct.CStruct):
 
@@ -219,6 +225,66 @@ class dface_t(cstruct.CStruct):
     def __repr__(self):
         return pformat(self.__dict__,width = 250,depth = 8)
 
+class FaceTable:
+    """
+    Struct-of-arrays form of dface_t lump, used in array mode.
+    Every dface_t field is stored as contiguous numpy array attribute (faces.texinfo, faces.firstedge...).
+    Indexing with int returns dface_t, indexing with slice, index array or mask returns FaceTable.
+    """
+
+    def __init__(self,columns):
+        self.columns = columns
+        for field,column in columns.items():
+            setattr(self,field,column)
+
+    @staticmethod
+    def from_array(faces):
+        """Creates FaceTable from dface_t structured array"""
+        return FaceTable({field:faces[field].copy() for field in dface_t.__fields__})
+
+    def __len__(self):
+        return len(self.firstedge)
+
+    def __getitem__(self, item):
+        if isinstance(item,(int,np.integer)):
+            return dface_t(**{field:column[item].tolist() for field,column in self.columns.items()})
+        return FaceTable({field:column[item] for field,column in self.columns.items()})
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __str__(self):
+        return pformat(self.columns,width = 250,depth = 8)
+
+    def __repr__(self):
+        return pformat(self.columns,width = 250,depth = 8)
+
+    def for_model(self,model):
+        """Returns faces of dmodel_t model (firstface/numfaces range)"""
+        return self[model['firstface']:model['firstface']+model['numfaces']]
+
+    def polygons(self,surfedges,edges):
+        """
+        Builds vertex index tuple for every face from surfedge and edge arrays.
+        Surfedge sign selects edge direction, first vertex of every directed edge is taken.
+        """
+        counts = self.numedges.astype(np.int64)
+        if not len(counts):
+            return []
+        ends = np.cumsum(counts)
+        index = np.repeat(self.firstedge.astype(np.int64)-(ends-counts),counts)+np.arange(ends[-1])
+        surfedge = surfedges[index]
+        vertexes = np.where(surfedge >= 0,edges[np.abs(surfedge),0],edges[np.abs(surfedge),1]).tolist()
+        polygons = []
+        start = 0
+        for end in ends.tolist():
+            # same vertex can't appear twice in polygon
+            polygons.append(tuple(OrderedDict.fromkeys(vertexes[start:end])))
+            start = end
+        return polygons
+
+
 class dbrush_t(cstruct.CStruct):
 
     __byte_order__ = cstruct.LITTLE_ENDIAN
@@ -295,7 +361,7 @@ class dleafbrush_t(cstruct.CStruct):
 
     def __repr__(self):
         return pformat(self.__dict__,width = 250,depth = 8)
-class textureVec:
+class textureVec(Record):
     """struct texinfo_t
 {
     float	textureVecs[2][4];	// [s/t][xyz offset]
@@ -303,17 +369,13 @@ class textureVec:
     int	flags;			// miptex flags	overrides
     int	texdata;		// Pointer to texture name, size, etc.
 }"""
+    __slots__ = ('x','y','z','offset')
 
     def __init__(self):
         self.x = 0
         self.y = 0
         self.z = 0
         self.offset = 0
-    def __str__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
     @staticmethod
     def readtextureVec(data):
         tVec = textureVec()
@@ -417,7 +479,8 @@ class ddispinfo_t:
     def TriangleTagCount(self):
         return 2 * self.power * self.power
 
-class CDispVert:
+class CDispVert(Record):
+    __slots__ = ('m_vVector','m_flDist','m_flAlpha')
     size = 20
     # {
     # public:
@@ -431,12 +494,6 @@ class CDispVert:
         self.m_flDist = 0.0
         self.m_flAlpha = 0.0
 
-    def __str__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
 class CDispSubNeighbor:
     size = 5
     # struct CDispSubNeighbor
@@ -492,17 +549,15 @@ class DisplaceCornerNeighbors:
 
     def __repr__(self):
         return pformat(self.__dict__,width = 250,depth = 8)
-class VertNormal:
+class VertNormal(Record):
+    __slots__ = ('x','y','z')
     size = 12
+    dtype = ('<f4',(3,))
     def __init__(self):
         self.x , self.y , self.z = 0,0,0
-    def __str__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
 class VertNormal_indexes:
     size = 2
+    dtype = '<u2'
     def __init__(self):
         self.indexes = [] #type: List[VertNormal]
     def __str__(self):
@@ -621,7 +676,7 @@ class color32:
     def toArrayRGB(self):
         return self.r,self.g,self.b
 
-class StaticPropLump_t:
+class StaticPropLump_t(Record):
     # struct StaticPropLump_t
     # {
     # 	// v4
@@ -653,6 +708,9 @@ class StaticPropLump_t:
     #         // since v9
     #         bool            DisableX360;     // if true, don't show on XBox 360
     # };
+    __slots__ = ('Origin','Angles','PropType','FirstLeaf','LeafCount','Solid','Flags','Skin','FadeMinDist','FadeMaxDist',
+                 'LightingOrigin','ForcedFadeScale','MinDXLevel','MaxDXLevel','MinCPULevel','MaxCPULevel','MinGPULevel',
+                 'MaxGPULevel','DiffuseModulation','unknown','DisableX360')
     def __init__(self):
         self.Origin = Vector()
         self.Angles = Vector()
@@ -675,11 +733,6 @@ class StaticPropLump_t:
         self.DiffuseModulation = color32
         self.unknown = 0
         self.DisableX360 = 0
-    def __str__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
-
-    def __repr__(self):
-        return pformat(self.__dict__,width = 250,depth = 8)
 
 class emittype_t(IntEnum):
 
@@ -0,0 +1,376 @@
+"""
+Synthetic BSP generator for scaling tests and benchmarks.
+
+Writes VBSP version 19, 20 or 21 files with every lump BSPreader decodes,
+sized by face, vertex, displacement, static prop, entity and pak parameters.
+Geometry is a grid of quads, displacements sit on the first faces, the content is random but reproducible by seed.
+
+Usage:
+    python BSP_generator.py out.bsp --faces 100000 --displacements 500 --power 3 --props 1000 --pak-size 50000000
+"""
+import argparse
+import io
+import math
+import os
+import random
+import struct
+import sys
+import zipfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from BSP_DATA import *
+
+VERSIONS = (19, 20, 21)
+# static prop game lump version written for each map version
+STATIC_PROP_VERSIONS = {19: 5, 20: 6, 21: 10}
+STATIC_PROP_ID = 1936749168  # 'sprp'
+# edges, planes and leaf faces are stored as unsigned shorts
+MAX_MAP_VERTS = 65536
+MAX_MAP_PLANES = 65536
+# faces reference displacements by signed short
+MAX_MAP_DISPINFO = 32767
+# lumps BSP_DATA.LUMP_ENUM doesn't list
+LUMP_PAKFILE = 40
+LUMP_DISP_TRIS = 48
+
+# (texture name, texinfo flags), faces mostly use the first two, the rest exercise surface classification
+TEXTURES = [
+    ('brick/brickwall001a', 0),
+    ('concrete/concretefloor001a', 0),
+    ('tools/toolsnodraw', SURF_NODRAW),
+    ('tools/toolsskybox', SURF_SKY),
+    ('tools/toolstrigger', SURF_TRIGGER),
+    ('glass/glasswindow001a', SURF_TRANS),
+]
+GRID_STEP = 64.0
+
+
+def face_texinfo(face):
+    """Every 16th face of each group gets one of the special surfaces"""
+    slot = face % 16
+    if slot < 12:
+        return slot % 2
+    return slot - 10
+
+
+class BSPGenerator:
+    """
+    Builds lumps in memory and writes them to file.
+    Lump layouts follow the engine structures of given version (leafs carry ambient lighting in v19,
+    world lights carry shadow offset in v21, static prop layout follows game lump version).
+    """
+
+    def __init__(self, faces=1000, vertexes=None, displacements=0, power=3, static_props=0, entities=10,
+                 lights=2, pak_size=0, version=20, seed=0):
+        if version not in VERSIONS:
+            raise ValueError('unsupported BSP version {}, expected one of {}'.format(version, VERSIONS))
+        if displacements > min(faces, MAX_MAP_DISPINFO):
+            raise ValueError('displacement count has to be at most face count and {}'.format(MAX_MAP_DISPINFO))
+        if not 2 <= power <= 4:
+            raise ValueError('displacement power has to be 2, 3 or 4')
+        self.faces = faces
+        if vertexes is None:
+            side = int(math.ceil(math.sqrt(max(faces, 1)))) + 1
+            vertexes = side * side
+        self.vertexes = max(4, min(vertexes, MAX_MAP_VERTS))
+        self.displacements = displacements
+        self.power = power
+        self.static_props = static_props
+        self.entities = entities
+        self.lights = lights
+        self.pak_size = pak_size
+        self.version = version
+        self.random = random.Random(seed)
+        self.lumps = {}
+
+    # geometry
+
+    def grid(self):
+        """Returns grid side length, grid is square part of vertexes, the rest are loose points"""
+        return max(2, min(int(math.sqrt(self.vertexes)), 256))
+
+    def face_corners(self, face):
+        side = self.grid()
+        cy, cx = divmod(face % ((side - 1) * (side - 1)), side - 1)
+        a = cy * side + cx
+        return a, a + 1, a + side + 1, a + side
+
+    def build_vertexes(self):
+        side = self.grid()
+        rnd = self.random.random
+        points = struct.Struct('<3f')
+        data = bytearray()
+        for i in range(self.vertexes):
+            if i < side * side:
+                y, x = divmod(i, side)
+                data += points.pack(x * GRID_STEP, y * GRID_STEP, rnd() * 8)
+            else:
+                data += points.pack(rnd() * side * GRID_STEP, rnd() * side * GRID_STEP, rnd() * 64)
+        self.lumps[LUMP_ENUM.LUMP_VERTEXES] = bytes(data)
+
+    def build_planes(self):
+        count = min(max(6, self.faces // 2), MAX_MAP_PLANES)
+        plane = struct.Struct('<4fi')
+        data = bytearray()
+        for i in range(count):
+            if i < 6:
+                axis = i % 3
+                normal = [0.0, 0.0, 0.0]
+                normal[axis] = 1.0 if i < 3 else -1.0
+                data += plane.pack(normal[0], normal[1], normal[2], 0.0, axis)
+            else:
+                data += plane.pack(0.0, 0.0, 1.0, self.random.random() * 8, 2)
+        self.lumps[LUMP_ENUM.LUMP_PLANES] = bytes(data)
+        self.planes = count
+
+    def build_faces(self):
+        """Faces, edges, surfedges and vertex normal indices, every face is quad with its own 4 edges"""
+        face = struct.Struct('<HBBihhhh4Bif2i2iiHHI')
+        edge = struct.Struct('<2H')
+        surfedge = struct.Struct('<i')
+        faces = bytearray()
+        edges = bytearray(edge.pack(0, 0))  # edge 0 is never referenced by surfedges
+        surfedges = bytearray()
+        for f in range(self.faces):
+            corners = self.face_corners(f)
+            firstedge = len(surfedges) // 4
+            for k in range(4):
+                start, end = corners[k], corners[(k + 1) % 4]
+                index = len(edges) // 4
+                # odd edges are stored reversed, so both surfedge directions are present
+                if k % 2:
+                    edges += edge.pack(end, start)
+                    surfedges += surfedge.pack(-index)
+                else:
+                    edges += edge.pack(start, end)
+                    surfedges += surfedge.pack(index)
+            dispinfo = f if f < self.displacements else -1
+            texinfo = 0 if dispinfo != -1 else face_texinfo(f)
+            faces += face.pack(f % self.planes, 0, 0, firstedge, 4, texinfo, dispinfo, -1,
+                               0, 255, 255, 255, -1, GRID_STEP * GRID_STEP, 0, 0, 0, 0, f, 0, 0, 0)
+        self.lumps[LUMP_ENUM.LUMP_FACES] = bytes(faces)
+        self.lumps[LUMP_ENUM.LUMP_ORIGINALFACES] = bytes(faces)
+        self.lumps[LUMP_ENUM.LUMP_EDGES] = bytes(edges)
+        self.lumps[LUMP_ENUM.LUMP_SURFEDGES] = bytes(surfedges)
+        # all faces point up, normal 4 is +Z
+        self.lumps[LUMP_ENUM.LUMP_VERTNORMALS] = b''.join(
+            struct.pack('<3f', *n) for n in ((1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)))
+        self.lumps[LUMP_ENUM.LUMP_VERTNORMALINDICES] = struct.pack('<H', 4) * (self.faces * 4)
+
+    def build_displacements(self):
+        side = (1 << self.power) + 1
+        verts = side * side
+        tris = 2 * (1 << self.power) ** 2
+        info = struct.Struct('<3fiiiifiHxxii')
+        sub_neighbor = struct.pack('<HBBBB', 0xFFFF, 0, 0, 0, 0)
+        corner_neighbor = struct.pack('<4HBx', 0xFFFF, 0xFFFF, 0xFFFF, 0xFFFF, 0)
+        vert = struct.Struct('<5f')
+        infos = bytearray()
+        disp_verts = bytearray()
+        rnd = self.random.random
+        for i in range(self.displacements):
+            corner = self.face_corners(i)[0]
+            y, x = divmod(corner, self.grid())
+            infos += info.pack(x * GRID_STEP, y * GRID_STEP, 0.0, i * verts, i * tris, self.power, 0, 0.0, 1, i, 0, 0)
+            infos += sub_neighbor * 8 + corner_neighbor * 4
+            infos += struct.pack('<10I', *([0xFFFFFFFF] * 10))
+            for _ in range(verts):
+                disp_verts += vert.pack(0.0, 0.0, 1.0, rnd() * 32, rnd() * 255)
+        self.lumps[LUMP_ENUM.LUMP_DISPINFO] = bytes(infos)
+        self.lumps[LUMP_ENUM.LUMP_DISP_VERTS] = bytes(disp_verts)
+        self.lumps[LUMP_DISP_TRIS] = b'\0\0' * (tris * self.displacements)
+
+    # textures
+
+    def build_textures(self):
+        names = [name for name, _ in TEXTURES]
+        offsets = []
+        string_data = bytearray()
+        for name in names:
+            offsets.append(len(string_data))
+            string_data += name.encode() + b'\0'
+        self.lumps[LUMP_ENUM.LUMP_TEXDATA_STRING_DATA] = bytes(string_data)
+        self.lumps[LUMP_ENUM.LUMP_TEXDATA_STRING_TABLE] = struct.pack('<{}i'.format(len(offsets)), *offsets)
+        self.lumps[LUMP_ENUM.LUMP_TEXDATA] = b''.join(
+            struct.pack('<3f5i', 0.5, 0.5, 0.5, i, 512, 512, 512, 512) for i in range(len(names)))
+        vecs = (1 / 4.0, 0, 0, 0, 0, 1 / 4.0, 0, 0, 1 / 16.0, 0, 0, 0, 0, 1 / 16.0, 0, 0)
+        self.lumps[LUMP_ENUM.LUMP_TEXINFO] = b''.join(
+            struct.pack('<16f2i', *(vecs + (flags, i))) for i, (_, flags) in enumerate(TEXTURES))
+
+    # tree
+
+    def build_tree(self):
+        """One node splitting world into solid leaf with single brush and empty leaf holding all faces"""
+        side = self.grid() * GRID_STEP
+        mins = (0, 0, -64)
+        maxs = (int(side), int(side), 128)
+        leaf_faces = min(self.faces, 0xFFFF)
+        self.lumps[LUMP_ENUM.LUMP_NODES] = struct.pack('<i2i3h3hHHhh', 0, -1, -2, *(mins + maxs + (0, leaf_faces, 0, 0)))
+        leafs = []
+        for contents, cluster, firstface, numfaces, numbrushes in ((1, -1, 0, 0, 1), (0, 0, 0, leaf_faces, 0)):
+            # area 1, no flags
+            leaf = struct.pack('<ihh3h3hHHHH', contents, cluster, 1,
+                               *(mins + maxs + (firstface, numfaces, 0, numbrushes)))
+            if self.version == 19:
+                # CompressedLightCube m_AmbientLighting
+                leaf += b'\0' * 24
+            leaf += struct.pack('<hxx', -1)
+            leafs.append(leaf)
+        self.lumps[LUMP_ENUM.LUMP_LEAFS] = b''.join(leafs)
+        self.lumps[LUMP_ENUM.LUMP_LEAFFACES] = struct.pack('<{}H'.format(leaf_faces), *range(leaf_faces))
+        self.lumps[LUMP_ENUM.LUMP_LEAFBRUSHES] = struct.pack('<H', 0)
+        self.lumps[LUMP_ENUM.LUMP_BRUSHES] = struct.pack('<3i', 0, 6, 1)
+        self.lumps[LUMP_ENUM.LUMP_BRUSHSIDES] = b''.join(struct.pack('<Hhhh', plane, 2, 0, 0) for plane in range(6))
+        self.lumps[LUMP_ENUM.LUMP_MODELS] = struct.pack('<9f3i', *(mins + maxs + (0, 0, 0, 0, 0, self.faces)))
+
+    # entities, lights, props and pak
+
+    def build_entities(self):
+        rnd = self.random.random
+        side = self.grid() * GRID_STEP
+        text = io.StringIO()
+        text.write('{\n"world_maxs" "%d %d 128"\n"world_mins" "0 0 -64"\n"skyname" "sky_day01_01"\n'
+                   '"mapversion" "1"\n"classname" "worldspawn"\n}\n' % (side, side))
+        for i in range(max(self.entities - 1, 0)):
+            classname = 'light' if i % 4 == 0 else 'info_target'
+            text.write('{\n"origin" "%.1f %.1f %.1f"\n"targetname" "%s_%d"\n"classname" "%s"\n}\n' % (
+                rnd() * side, rnd() * side, rnd() * 128, classname, i, classname))
+        self.lumps[LUMP_ENUM.LUMP_ENTITIES] = text.getvalue().encode() + b'\0'
+
+    def build_lights(self):
+        rnd = self.random.random
+        side = self.grid() * GRID_STEP
+        lights = bytearray()
+        for _ in range(self.lights):
+            lights += struct.pack('<9f', rnd() * side, rnd() * side, 64.0, 100.0, 100.0, 100.0, 0.0, 0.0, -1.0)
+            if self.version >= 21:
+                # shadow_cast_offset
+                lights += struct.pack('<3f', 0.0, 0.0, 0.0)
+            # cluster, type (emit_point), style, stopdot, stopdot2, exponent, radius, attenuation, flags, texinfo, owner
+            lights += struct.pack('<3i7f3i', 0, 1, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0, 0, 0)
+        self.lumps[LUMP_ENUM.LUMP_WORLDLIGHTS] = bytes(lights)
+
+    def static_prop_lump(self):
+        version = STATIC_PROP_VERSIONS[self.version]
+        rnd = self.random.random
+        side = self.grid() * GRID_STEP
+        names = min(max(self.static_props, 1), 64)
+        data = bytearray(struct.pack('<i', names))
+        for i in range(names):
+            data += 'models/props/generated_{}.mdl'.format(i).encode().ljust(128, b'\0')
+        data += struct.pack('<ih', 1, 1)
+        data += struct.pack('<i', self.static_props)
+        for i in range(self.static_props):
+            origin = (rnd() * side, rnd() * side, 0.0)
+            data += struct.pack('<6fHHHBBiff3f', *(origin + (0.0, rnd() * 360, 0.0, i % names, 0, 1, 6, 0, 0,
+                                                            0.0, 0.0) + origin))
+            if version >= 5:
+                data += struct.pack('<f', 1.0)
+            if version in (6, 7):
+                data += struct.pack('<HH', 0, 0)
+            if version >= 8:
+                data += struct.pack('<4B', 0, 0, 0, 0)
+            if version >= 7:
+                data += struct.pack('<4B', 255, 255, 255, 255)
+            if version >= 10:
+                data += struct.pack('<f', 0.0)
+            if version >= 9:
+                data += struct.pack('<I', 0)
+        return version, bytes(data)
+
+    def build_pak(self):
+        """Pak lump is stored zip with one material and random payload files adding up to pak_size bytes"""
+        pak = io.BytesIO()
+        with zipfile.ZipFile(pak, 'w', zipfile.ZIP_STORED) as zip_file:
+            zip_file.writestr('materials/generated/base.vmt', '"LightmappedGeneric"\n{\n"$basetexture" "brick/brickwall001a"\n}\n')
+            remaining = self.pak_size
+            i = 0
+            while remaining > 0:
+                size = min(remaining, 1024 * 1024)
+                payload = self.random.getrandbits(size * 8).to_bytes(size, 'little')
+                zip_file.writestr('materials/generated/payload_{}.vtf'.format(i), payload)
+                remaining -= size
+                i += 1
+        self.lumps[LUMP_PAKFILE] = pak.getvalue()
+
+    def build(self):
+        self.build_vertexes()
+        self.build_planes()
+        self.build_faces()
+        self.build_displacements()
+        self.build_textures()
+        self.build_tree()
+        self.build_entities()
+        self.build_lights()
+        self.build_pak()
+        return self.lumps
+
+    def write(self, path):
+        """Builds all lumps and writes map to path, returns {lump: size} of written lumps"""
+        if not self.lumps:
+            self.build()
+        header_size = 8 + HEADER_LUMPS * 16 + 4
+        directory = [(0, 0)] * HEADER_LUMPS
+        with open(path, 'wb') as f:
+            f.write(b'\0' * header_size)
+            for lump_id in sorted(self.lumps):
+                directory[lump_id] = self._write_lump(f, self.lumps[lump_id])
+            # game lump entries hold absolute file offsets, so it's written once its position is known
+            prop_version, props = self.static_prop_lump()
+            start = self._align(f)
+            entry = struct.Struct('<iHHii')
+            game_lump = struct.pack('<i', 1) + entry.pack(STATIC_PROP_ID, 0, prop_version,
+                                                          start + 4 + entry.size, len(props)) + props
+            directory[LUMP_ENUM.LUMP_GAME_LUMP] = self._write_lump(f, game_lump)
+            f.seek(0)
+            f.write(b'VBSP' + struct.pack('<i', self.version))
+            for fileofs, filelen in directory:
+                f.write(struct.pack('<iii4s', fileofs, filelen, 0, b'\0\0\0\0'))
+            f.write(struct.pack('<i', 1))
+        names = {lump.value: lump.name for lump in LUMP_ENUM}
+        names.update({LUMP_PAKFILE: 'LUMP_PAKFILE', LUMP_DISP_TRIS: 'LUMP_DISP_TRIS'})
+        return {names.get(lump_id, str(lump_id)): filelen for lump_id, (_, filelen) in enumerate(directory) if filelen}
+
+    @staticmethod
+    def _align(f):
+        # lumps start on 4 byte boundary
+        f.write(b'\0' * (-f.tell() % 4))
+        return f.tell()
+
+    def _write_lump(self, f, data):
+        start = self._align(f)
+        f.write(data)
+        return start, len(data)
+
+
+def generate(path, **options):
+    """Writes synthetic map to path, see BSPGenerator for options. Returns {lump name: size}"""
+    return BSPGenerator(**options).write(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic BSP map for tests and benchmarks')
+    parser.add_argument('output', help='path of BSP file to write')
+    parser.add_argument('-f', '--faces', type=int, default=1000)
+    parser.add_argument('-v', '--vertexes', type=int, default=None,
+                        help='vertex count, by default enough to give every face its own grid cell')
+    parser.add_argument('-d', '--displacements', type=int, default=0)
+    parser.add_argument('-p', '--power', type=int, default=3, help='displacement power (2-4)')
+    parser.add_argument('-s', '--props', type=int, default=0, help='static prop count')
+    parser.add_argument('-e', '--entities', type=int, default=10)
+    parser.add_argument('-l', '--lights', type=int, default=2)
+    parser.add_argument('-k', '--pak-size', type=int, default=0, help='approximate pak lump size in bytes')
+    parser.add_argument('--version', type=int, default=20, choices=VERSIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    sizes = generate(args.output, faces=args.faces, vertexes=args.vertexes, displacements=args.displacements,
+                     power=args.power, static_props=args.props, entities=args.entities, lights=args.lights,
+                     pak_size=args.pak_size, version=args.version, seed=args.seed)
+    for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        print('{:<32} {:>12}'.format(name, size))
+    print('{:<32} {:>12}'.format('TOTAL', os.path.getsize(args.output)))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,8 @@ import time
 
 import math
 
+import numpy as np
+
 from BSP_DATA import *
 
 
@@ -26,6 +28,7 @@ def getpath() -> str:
 
 
 import progressBar
+from profiler import NullProfiler
 
 import io
 from contextlib import redirect_stdout
@@ -40,6 +43,18 @@ BLANK = {'textureVecs': [{'x': 0.0, 'y': 0.0, 'z': 2.857142925262451, 'offset':
                          {'x': 0.0, 'y': -2.857142925262451, 'z': 0.0, 'offset': 98.89399719238281}],
          'lightmapVecs': [{'x': 0.0, 'y': 0.0, 'z': 0.0625, 'offset': -1.3875006437301636},
                           {'x': 0.0, 'y': -0.0625, 'z': 0.0, 'offset': 2.16330623626709}], 'flags': 2048, 'texdata': 3}
+# surface flag -> mesh type, checked in this order, first matching flag wins
+SURFACE_TYPES = [('TRIGGER', BSP_DATA.SURF_TRIGGER),
+                 ('NODRAW', BSP_DATA.SURF_NODRAW),
+                 ('SKIP', BSP_DATA.SURF_SKIP),
+                 ('SKY2D', BSP_DATA.SURF_SKY2D),
+                 ('SKY', BSP_DATA.SURF_SKY),
+                 ('HITBOX', BSP_DATA.SURF_HITBOX),
+                 ('NOCHOP', BSP_DATA.SURF_NOCHOP),
+                 ('NODECALS', BSP_DATA.SURF_NODECALS),
+                 ('NOLIGHT', BSP_DATA.SURF_NOLIGHT),
+                 ('HINT', BSP_DATA.SURF_HINT),
+                 ('TRANS', BSP_DATA.SURF_TRANS)]
 BLANK_texInfo = BSP_DATA.texinfo_t()
 for k, v in BLANK.items():
 
@@ -96,23 +111,32 @@ vtflib = 'VTF64' if is_os_64bit() else 'VTF32'
 
 
 class mesh:
-    def __init__(self, filepath: str, doTexture, workdir='',staticProps = False):
+    def __init__(self, filepath: str, doTexture, workdir='',staticProps = False, profiler=None):
         self.workdir = workdir
+        # optional profiler.Profiler, results are available from self.profiler.report()
+        self.profiler = profiler if profiler is not None else NullProfiler()
         self.armature_object = None
         fileNameWithOutExt = ".".join(filepath.split('.')[:-1]).replace('.dx90', '')
 
         # print(fileNameWithOutExt)
 
-        self.BSP = BSP_reader.BSPreader(fileNameWithOutExt + '.bsp', workdir)
-        self.CreateMesh(fileNameWithOutExt.split(os.sep)[-1])
+        # parsed VPK directories of the game are kept in Blender's user datafiles between imports
+        index_cache = bpy.utils.user_resource('DATAFILES', 'io_mesh_SourceBSP/vpk_index', create=True)
+        with self.profiler.measure('open'):
+            self.BSP = BSP_reader.BSPreader(fileNameWithOutExt + '.bsp', workdir, use_mmap=True, use_arrays=True,
+                                            profiler=self.profiler, index_cache=index_cache)
+        with self.profiler.measure('create_mesh'):
+            self.CreateMesh(fileNameWithOutExt.split(os.sep)[-1])
         # if doTexture:
         #     try:
         #         self.processTextures()
         #     except:
         #         print('TEXTURE IMPORT ERROR')
         if staticProps:
-            self.loadStaticProps()
-        self.addLights()
+            with self.profiler.measure('static_props'):
+                self.loadStaticProps()
+        with self.profiler.measure('lights'):
+            self.addLights()
         self.BSP.finish()
 
     def getMeshMaterial(self, mat_name, model_ob):
@@ -153,161 +177,52 @@ class mesh:
         return mat, mat_ind
 
     def process_models(self, base_name, models):
-        self.vets = [(vert.x, vert.y, vert.z) for vert in self.BSP.BSP.LUMPS[3]]
-        self.norms = [(normal.x, normal.y, normal.z) for normal in
-                      [self.BSP.BSP.LUMPS[30][normal_ind] for normal_ind in self.BSP.BSP.LUMPS[31].indexes]]
+        self.vets = self.BSP.BSP.LUMPS[3].tolist()
+        self.norms = self.BSP.BSP.LUMPS[30][self.BSP.BSP.LUMPS[31]].tolist()
+        texinfo_flags = np.array([texInfo.flags for texInfo in self.BSP.BSP.LUMPS[6]])
         for i, model in enumerate(models):
-            types = {}  # type:Dict[List]
-            displacement_faces  = []
-            faces = []
-            normals = []
-            mats = []
-            uvs = [None for _ in self.BSP.BSP.LUMPS[3]]
-            mat_ind = []
-            for face in self.BSP.BSP.LUMPS[7][model.firstface:model.firstface + model.numfaces]:
-                layer = 2
-                # face = self.BSP.BSP.LUMPS[27][face.origFace]
-                texInfo = self.BSP.BSP.LUMPS[6][face.texinfo]
-                if (texInfo.flags & BSP_DATA.SURF_TRIGGER) > 0:
-                    type_ = 'TRIGGER'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_NODRAW) > 0:
-                    type_ = 'NODRAW'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_SKIP) > 0:
-                    type_ = 'SKIP'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_SKY2D) > 0:
-                    type_ = 'SKY2D'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_SKY) > 0:
-                    type_ = 'SKY'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_HITBOX) > 0:
-                    type_ = 'HITBOX'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_NOCHOP) > 0:
-                    type_ = 'NOCHOP'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_NODECALS) > 0:
-                    type_ = 'NODECALS'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_NOLIGHT) > 0:
-                    type_ = 'NOLIGHT'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_SKIP) > 0:
-                    type_ = 'SKIP'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_HINT) > 0:
-                    type_ = 'HINT'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif (texInfo.flags & BSP_DATA.SURF_TRANS) > 0:
-                    type_ = 'TRANS'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-                elif face.dispinfo!=-1:
-                    displacement_faces.append(face)
-                    type_ = 'DISP'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-                else:
-                    type_ = 'MESH'
-                    if type_ not in types:
-                        types[type_] = [face]
-                    else:
-                        types[type_].append(face)
-
-            self.generate_model(base_name, i, types, model)
-            self.process_displacement(base_name,displacement_faces,model)
+            with self.profiler.measure('classify_faces', model=i) as step:
+                types = {}  # type:Dict[FaceTable]
+                faces = self.BSP.BSP.LUMPS[7].for_model(model)  # type: FaceTable
+                step['count'] = len(faces)
+                flags = texinfo_flags[faces.texinfo]
+                unassigned = np.ones(len(faces), dtype=bool)
+                for type_, flag in SURFACE_TYPES:
+                    mask = unassigned & ((flags & flag) > 0)
+                    if mask.any():
+                        types[type_] = faces[mask]
+                    unassigned &= ~mask
+                disp_mask = unassigned & (faces.dispinfo != -1)
+                displacement_faces = faces[disp_mask]
+                if disp_mask.any():
+                    types['DISP'] = displacement_faces
+                mesh_mask = unassigned & ~disp_mask
+                if mesh_mask.any():
+                    types['MESH'] = faces[mesh_mask]
+
+            with self.profiler.measure('generate_model', model=i) as step:
+                step['count'] = len(faces) - len(displacement_faces)
+                self.generate_model(base_name, i, types, model)
+            with self.profiler.measure('displacements', model=i) as step:
+                step['count'] = len(displacement_faces)
+                self.process_displacement(base_name,displacement_faces,model)
 
     def process_displacement(self, base_name, faces,model):
-        for face in faces:  # type: dface_t
+        polygons = faces.polygons(self.BSP.BSP.LUMPS[13], self.BSP.BSP.LUMPS[12])
+        for face, faceindexes in zip(faces, polygons):  # type: dface_t
             dispinfo = self.BSP.BSP.LUMPS[LUMP_ENUM.LUMP_DISPINFO][face.dispinfo]  # type: ddispinfo_t
             name = '{}_{}_{}'.format(base_name, 'DISP', face.dispinfo)
 
             model_mesh = bpy.data.objects.new(name, bpy.data.meshes.new(name))
             for i in range(20):
                 model_mesh.layers[i] = (i == 7)
-            model_mesh.location = (model.origin.x, model.origin.y, model.origin.z)
+            model_mesh.location = model['origin'].tolist()
             model_mesh.parent = self.armature_object
             bpy.context.scene.objects.link(model_mesh)
             md = model_mesh.data
-            firstedge = face.firstedge
-            numedges = face.numedges
             texInfo = self.BSP.BSP.LUMPS[6][face.texinfo]
             texdata = self.BSP.BSP.LUMPS[2][texInfo.texdata]
             mat_name = self.BSP.BSP.LUMPS[43][texdata.nameStringTableID]
-            faceindexes = []
-            uvs = []
-            edge_indexs = [self.BSP.BSP.LUMPS[13][firstedge + ind].surfedge for ind in range(numedges)]
-            for edge_index in edge_indexs:
-                edges = self.BSP.BSP.LUMPS[12][abs(edge_index)].v
-                if edge_index < 0:
-                    if edges[1] not in faceindexes:
-                        faceindexes.append(edges[1])
-                    if edges[0] not in faceindexes:
-                        faceindexes.append(edges[0])
-                else:
-                    if edges[0] not in faceindexes:
-                        faceindexes.append(edges[0])
-                    if edges[1] not in faceindexes:
-                        faceindexes.append(edges[1])
-
-                for v in edges:
-                    x, y, z = self.vets[v]
-                    tv = texInfo.textureVecs
-                    u = tv[0].x * x + tv[0].y * y + tv[0].z * z + tv[0].offset
-                    v = tv[1].x * x + tv[1].y * y + tv[1].z * z + tv[1].offset
-                    uvs.append((u, v))
             md.from_pydata(self.vets, [], [faceindexes])
             md.update()
             bpy.context.scene.objects.active = model_mesh
@@ -373,48 +288,16 @@ class mesh:
     def generate_model(self, base_name, i, types, model):
         print('Importing map geometry:', base_name)
         for type_, faces_ in types.items():
-            faces = []
-            mat_ind = []
             mats = []
-            uvs = [None for _ in self.BSP.BSP.LUMPS[3]]
             field = progressBar.Progress_bar('Generating {} mesh'.format('{}_{}'.format(base_name, type_)), len(faces_),20)
-            for face in faces_:
-
-                faceindexes = []
-                firstedge = face.firstedge
-                numedges = face.numedges
-                texInfo = self.BSP.BSP.LUMPS[6][face.texinfo]
-                texdata = self.BSP.BSP.LUMPS[2][texInfo.texdata]
-                mat_name = self.BSP.BSP.LUMPS[43][texdata.nameStringTableID]
-                mat_ind.append((texInfo.texdata, mat_name))
-
-                edge_indexs = [self.BSP.BSP.LUMPS[13][firstedge + ind].surfedge for ind in range(numedges)]
-                for edge_index in edge_indexs:
-                    edges = self.BSP.BSP.LUMPS[12][abs(edge_index)].v
-                    if edge_index < 0:
-                        if edges[1] not in faceindexes:
-                            faceindexes.append(edges[1])
-                        if edges[0] not in faceindexes:
-                            faceindexes.append(edges[0])
-                    else:
-                        if edges[0] not in faceindexes:
-                            faceindexes.append(edges[0])
-                        if edges[1] not in faceindexes:
-                            faceindexes.append(edges[1])
-
-                    for v in edges:
-                        x, y, z = self.vets[v]
-                        tv = texInfo.textureVecs
-                        u = tv[0].x * x + tv[0].y * y + tv[0].z * z + tv[0].offset
-                        v = tv[1].x * x + tv[1].y * y + tv[1].z * z + tv[1].offset
-                        uvs.append((u, v))
-                faces.append(tuple(faceindexes))
-                field.increment(1)
-                field.draw()
+            faces = faces_.polygons(self.BSP.BSP.LUMPS[13], self.BSP.BSP.LUMPS[12])
+            texdatas = [self.BSP.BSP.LUMPS[6][texinfo].texdata for texinfo in faces_.texinfo.tolist()]
+            field.increment(len(faces_))
+            field.draw()
             name = '{}_{}_{}'.format(base_name, type_, i)
 
             model_mesh = bpy.data.objects.new(name, bpy.data.meshes.new(name))
-            model_mesh.location = (model.origin.x, model.origin.y, model.origin.z)
+            model_mesh.location = model['origin'].tolist()
             model_mesh.parent = self.armature_object
             bpy.context.scene.objects.link(model_mesh)
             md = model_mesh.data
@@ -430,8 +313,7 @@ class mesh:
             #     print(E)
             #     print('FAILED TO SET CUSTOM NORMALS')
             try:
-                vert_n = list([(-self.BSP.BSP.LUMPS[30][vert_n].x, -self.BSP.BSP.LUMPS[30][vert_n].y,
-                                -self.BSP.BSP.LUMPS[30][vert_n].z) for vert_n in self.BSP.BSP.LUMPS[31].indexes])
+                vert_n = (-self.BSP.BSP.LUMPS[30][self.BSP.BSP.LUMPS[31]]).tolist()
                 md.create_normals_split()
                 md.use_auto_smooth = True
                 md.normals_split_custom_set_from_vertices(vert_n)
@@ -439,20 +321,17 @@ class mesh:
             except Exception as Ex:
                 print(Ex)
 
-            for _, mat_name in mat_ind:
-
-                if mat_name.startswith('maps/'):
-                    mat_name = mat_name.split('/')[-1]
-                    mat_name = '_'.join(mat_name.split('_')[:-3])
+            mat_indexes = {}
+            for texdata in texdatas:
+                if texdata not in mat_indexes:
+                    mat_name = self.BSP.BSP.LUMPS[43][self.BSP.BSP.LUMPS[2][texdata].nameStringTableID]
+                    if mat_name.startswith('maps/'):
+                        mat_name = mat_name.split('/')[-1]
+                        mat_name = '_'.join(mat_name.split('_')[:-3])
 
-                mat, mat_ind_ = self.getMeshMaterial(mat_name, model_mesh)
-                mats.append(mat_ind_)
+                    mat, mat_indexes[texdata] = self.getMeshMaterial(mat_name, model_mesh)
+                mats.append(mat_indexes[texdata])
             md.uv_textures.new()
-            uv_data = md.uv_layers[0].data
-            for i in range(len(uv_data)):
-                if uvs[md.loops[i].vertex_index] is None:
-                    continue
-                uv_data[i].uv = uvs[md.loops[i].vertex_index]
             for poly, mat_index in zip(model_mesh.data.polygons, mats):
                 poly.material_index = mat_index
             bpy.ops.object.select_all(action="DESELECT")
@@ -1,7 +1,10 @@
+import io
+import mmap
 import os
-import re
+import shutil
 import struct
 import sys
+import tempfile
 def getpath() -> str:
     """
 
@@ -14,17 +17,164 @@ sys.path.append('E:\\PYTHON\\BSP_reader')
 from  pprint import pprint
 from BSP_DATA import *
 from LIBS import KeyValue_parser
+import vfs
+import gameinfo
+from profiler import NullProfiler
 import zipfile
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only required by use_arrays mode
+    np = None
+
+
+class LazyLumps:
+    """
+    List-like holder for decoded lumps.
+    Lump is decoded by its reader method on first access and cached after that.
+    """
+
+    def __init__(self,reader,loaders):
+        self.reader = reader
+        self.loaders = loaders
+        self.lumps = [None]*HEADER_LUMPS
+        self.loaded = [False]*HEADER_LUMPS
+
+    def __getitem__(self, item):
+        if not self.loaded[item]:
+            self.load(item)
+        return self.lumps[item]
+
+    def __setitem__(self, item, value):
+        self.lumps[item] = value
+        self.loaded[item] = True
+
+    def __len__(self):
+        return len(self.lumps)
+
+    def __repr__(self):
+        return pformat(self.lumps,width = 250,depth = 8)
+
+    def is_loaded(self,item):
+        return self.loaded[item]
+
+    def load(self,item):
+        reader = self.reader
+        lump = reader.BSP.lump_t[item]
+        name = LUMP_ENUM(item).name if item in self.loaders else 'LUMP_{}'.format(item)
+        with reader.profiler.measure(name,lump.filelen,lump = int(item)) as step:
+            self._load(item)
+            value = self.lumps[item]
+            if hasattr(value,'__len__'):
+                step['count'] = len(value)
+
+    def _load(self,item):
+        # lump can be requested from inside another reader (texdata needs string table),
+        # so file position of the outer reader has to survive
+        pos = self.reader.data.tell()
+        for method in self.loaders.get(item,()):
+            getattr(self.reader,method)()
+        self.loaded[item] = True
+        self.reader.data.seek(pos)
+
+    def load_all(self):
+        """Decodes every known lump"""
+        for item in sorted(self.loaders):
+            self[item]
+
+
+class LumpView(io.RawIOBase):
+    """
+    Read-only seekable window over part of file or mapped buffer.
+    Data is read from source only when requested, so zipfile can work on pak lump without copying it.
+    """
+
+    def __init__(self,source,offset,length):
+        super().__init__()
+        self.offset = offset
+        self.length = length
+        self.pos = 0
+        if isinstance(source,str):
+            # own handle, so cursor of reader and other views isn't disturbed
+            self.file = open(source,'rb')
+            self.buffer = None
+        else:
+            self.file = None
+            self.buffer = memoryview(source)[offset:offset+length]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self,pos,whence = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        if pos < 0:
+            raise ValueError('negative seek position {}'.format(pos))
+        self.pos = pos
+        return self.pos
+
+    def readinto(self,b):
+        size = max(0,min(len(b),self.length-self.pos))
+        if not size:
+            return 0
+        if self.buffer is not None:
+            b[:size] = self.buffer[self.pos:self.pos+size]
+        else:
+            self.file.seek(self.offset+self.pos)
+            size = self.file.readinto(memoryview(b)[:size])
+        self.pos += size
+        return size
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        super().close()
+
+
 class BSPreader:
+    # lump index -> reader methods that decode it, methods store result into self.BSP.LUMPS
+    LUMP_READERS = {
+        LUMP_ENUM.LUMP_ENTITIES:                ('readEntities',),
+        LUMP_ENUM.LUMP_PLANES:                  ('readPlanes',),
+        LUMP_ENUM.LUMP_TEXDATA:                 ('readTexdata',),
+        LUMP_ENUM.LUMP_VERTEXES:                ('readVertexs',),
+        LUMP_ENUM.LUMP_NODES:                   ('readNodes',),
+        LUMP_ENUM.LUMP_TEXINFO:                 ('readTexinfo',),
+        LUMP_ENUM.LUMP_FACES:                   ('readOrigFaces',),
+        LUMP_ENUM.LUMP_LEAFS:                   ('readLeafs',),
+        LUMP_ENUM.LUMP_EDGES:                   ('readEdges',),
+        LUMP_ENUM.LUMP_SURFEDGES:               ('readSurfedges',),
+        LUMP_ENUM.LUMP_MODELS:                  ('readModel',),
+        LUMP_ENUM.LUMP_WORLDLIGHTS:             ('readWorldLights',),
+        LUMP_ENUM.LUMP_LEAFFACES:               ('readLeaffaces',),
+        LUMP_ENUM.LUMP_LEAFBRUSHES:             ('readLeafbrush',),
+        LUMP_ENUM.LUMP_BRUSHES:                 ('readBrushes',),
+        LUMP_ENUM.LUMP_BRUSHSIDES:              ('readBrusheSides',),
+        LUMP_ENUM.LUMP_DISPINFO:                ('readDispinfo',),
+        LUMP_ENUM.LUMP_ORIGINALFACES:           ('readFaces',),
+        LUMP_ENUM.LUMP_VERTNORMALS:             ('readVertNormals',),
+        LUMP_ENUM.LUMP_VERTNORMALINDICES:       ('readVertNormalsIndexes',),
+        LUMP_ENUM.LUMP_DISP_VERTS:              ('readDispVert',),
+        LUMP_ENUM.LUMP_GAME_LUMP:               ('readdgamelumpheader_t','readStatic_props'),
+        LUMP_ENUM.LUMP_TEXDATA_STRING_DATA:     ('TexdataStringTable',),
+        LUMP_ENUM.LUMP_TEXDATA_STRING_TABLE:    ('readTexdataStringData',),
+    }
 
     def parseGameInfo(self,path_to_GI):
-        # print('path_to_GI',path_to_GI)
-        if 'gameinfo.txt' not in path_to_GI:
-            path_to_GI = os.path.join(path_to_GI,'gameinfo.txt')
-        gameinfo = open(path_to_GI,'r').read()
-        commendstripper = re.compile(r'Game[ \t]+(?P<path>[\w+|.]+)')
-        gameinfo = commendstripper.findall(gameinfo)
-        return gameinfo
+        # parsed search paths are shared by every reader of the same game
+        return gameinfo.load(path_to_GI)
 
 
     def readASCII(self,len_):
@@ -72,42 +222,38 @@ class BSPreader:
         return string.split('\0', 1)[0]
 
 
-    def __init__(self,fileUrl,gameInfo_path = None):
+    def __init__(self,fileUrl,gameInfo_path = None,lazy = True,use_mmap = False,use_arrays = False,
+                 profiler = None,index_cache = None):
+        if use_arrays and np is None:
+            raise ImportError('numpy is required for use_arrays mode')
+        self.use_arrays = use_arrays
         if gameInfo_path !=None:
-            self.gameInfo_path = gameInfo_path if 'gameinfo.txt' in gameInfo_path else gameInfo_path.replace('gameinfo.txt','')
             self.gameInfo = self.parseGameInfo(gameInfo_path)
+            self.gameInfo_path = self.gameInfo.root
         else:
             self.gameInfo_path = None
             self.gameInfo = None
-        self.data = open(fileUrl,'rb')
-        self.BSP = self.readHeader()
-
-        self.readPlanes()
-        self.readVertexs()
-        self.readEdges()
-        self.readSurfedges()
-        self.readFaces()
-        self.readOrigFaces()
-        self.readBrushes()
-        self.readBrusheSides()
-        self.readNodes()
-        self.readLeafs()
-        self.readLeaffaces()
-        self.readLeafbrush()
-        self.readTexinfo()
-        self.TexdataStringTable()
-        self.readTexdata()
-        self.readTexdataStringData()
-        self.readModel()
-        self.readEntities()
-        self.readPak()
-        self.readVertNormals()
-        self.readVertNormalsIndexes()
-        self.readDispinfo()
-        self.readDispVert()
-        self.readdgamelumpheader_t()
-        self.readStatic_props()
-        self.readWorldLights()
+        self.file = open(fileUrl,'rb')
+        if use_mmap:
+            # mmap object has same read/seek/tell interface as file, so cursor based readers work unchanged
+            self.mmap = mmap.mmap(self.file.fileno(),0,access = mmap.ACCESS_READ)
+            self.data = self.mmap
+        else:
+            self.mmap = None
+            self.data = self.file
+        self._PAK = None
+        self._vfs = None
+        # directory where parsed VPK indexes of game filesystem are kept between imports
+        self.index_cache = index_cache
+        # temporary directory of files extracted from pak and VPK archives, see extractFile
+        self._extract_dir = None
+        # profiler.Profiler instance collects per-lump timings, see profiler.py
+        self.profiler = profiler if profiler is not None else NullProfiler()
+        with self.profiler.measure('header',8+HEADER_LUMPS*16+4):
+            self.BSP = self.readHeader()
+        if not lazy:
+            self.BSP.LUMPS.load_all()
+            self.readPak()
         # for vertex in self.BSP.LUMPS[3]:
         #     print(vertex)
         if __name__ == '__main__':
@@ -168,7 +314,7 @@ class BSPreader:
         for num in range(HEADER_LUMPS):
             header.lump_t.append(self.readLump_t())
         header.mapRevision = self.readInt32()
-        header.LUMPS = [None]*64
+        header.LUMPS = LazyLumps(self,self.LUMP_READERS)
         return header
     def readLump_t(self):
         lump = lump_t()
@@ -178,329 +324,261 @@ class BSPreader:
         lump.fourCC = self.readBytes(4)
         return lump
 
+    def read_data(self,offset,length):
+        """
+        Returns length bytes of file starting at offset.
+        In mmap mode this is zero-copy memoryview slice of mapped file, otherwise bytes read from file.
+        """
+        if self.mmap is not None:
+            return memoryview(self.mmap)[offset:offset+length]
+        self.data.seek(offset)
+        return self.data.read(length)
+
+    def lump_data(self,lump_id):
+        """Returns raw lump data, see read_data"""
+        lump = self.BSP.lump_t[lump_id]
+        return self.read_data(lump.fileofs,lump.filelen)
+
+    def lump_view(self,lump_id):
+        """Returns seekable file-like LumpView over lump, lump data isn't read up front"""
+        lump = self.BSP.lump_t[lump_id]
+        return LumpView(self.mmap if self.mmap is not None else self.file.name,lump.fileofs,lump.filelen)
+
+    def iter_lump(self,lump_id,fmt):
+        """Yields tuples unpacked with fmt from each whole record in lump"""
+        data = self.lump_data(lump_id)
+        size = struct.calcsize(fmt)
+        return struct.iter_unpack(fmt,data[:len(data)//size*size])
+
+    def readArray(self,lump_id,dtype):
+        """
+        Returns numpy array built from lump data without per element objects.
+        Array shares memory with lump data, so it is read-only.
+        """
+        data = self.lump_data(lump_id)
+        dtype = np.dtype(dtype)
+        return np.frombuffer(data,dtype,len(data)//dtype.itemsize)
+
+    def readStructs(self,lump_id,type_):
+        """
+        Unpacks lump as cstruct.CStructArray table of type_ records,
+        or as zero-copy numpy structured array in use_arrays mode
+        """
+        if self.use_arrays:
+            return type_.view_array(self.lump_data(lump_id))
+        return type_.unpack_array(self.lump_data(lump_id))
+
     def readPlanes(self):
+        if self.use_arrays:
+            self.BSP.LUMPS[1] = self.readArray(1,dplane_t.dtype)
+            return
         PLANES = []
-        lump_data = self.BSP.lump_t[1]
-        self.data.seek(lump_data.fileofs,0)
-        for _ in range(lump_data.filelen//dplane_t.size):
+        for x,y,z,dist,type_ in self.iter_lump(1,'<4fi'):
             plane = dplane_t()
-            plane.normal.x = self.readFloat()
-            plane.normal.y = self.readFloat()
-            plane.normal.z = self.readFloat()
-            plane.dist = self.readFloat()
-            plane.type = self.readInt32()
+            plane.normal.x = x
+            plane.normal.y = y
+            plane.normal.z = z
+            plane.dist = dist
+            plane.type = type_
             PLANES.append(plane)
         self.BSP.LUMPS[1] = PLANES
 
     def readVertexs(self):
+        if self.use_arrays:
+            self.BSP.LUMPS[3] = self.readArray(3,Vector.dtype)
+            return
         VERTEXES = []
-        vertex_data = self.BSP.lump_t[3]
-        self.data.seek(vertex_data.fileofs)
-        for _ in range(vertex_data.filelen//Vector.size):
+        for x,y,z in self.iter_lump(3,'<3f'):
             vertex = Vector()
-            vertex.x = self.readFloat()
-            vertex.y = self.readFloat()
-            vertex.z = self.readFloat()
+            vertex.x = x
+            vertex.y = y
+            vertex.z = z
             VERTEXES.append(vertex)
         self.BSP.LUMPS[3] = VERTEXES
 
     def readEdges(self):
+        if self.use_arrays:
+            self.BSP.LUMPS[12] = self.readArray(12,dedge_t.dtype)
+            return
         EDGES = []
-        edge_data = self.BSP.lump_t[12]
-        self.data.seek(edge_data.fileofs,0)
-        for _ in range(edge_data.filelen//dedge_t.size):
+        for v in self.iter_lump(12,'<2H'):
             edge = dedge_t()
-            edge.v = [self.readUInt16(),self.readUInt16()]
+            edge.v = list(v)
             EDGES.append(edge)
         self.BSP.LUMPS[12] = EDGES
     def readSurfedges(self):
+        if self.use_arrays:
+            self.BSP.LUMPS[13] = self.readArray(13,Surfedge.dtype)
+            return
         SEDGES = []
-        sedge_data = self.BSP.lump_t[13]
-        self.data.seek(sedge_data.fileofs)
-        for _ in range(sedge_data.filelen//Surfedge.size):
+        for surfedge, in self.iter_lump(13,'<i'):
             sedge = Surfedge()
-            sedge.surfedge = self.readInt32()
+            sedge.surfedge = surfedge
             SEDGES.append(sedge)
         self.BSP.LUMPS[13] = SEDGES
 
     def readFaces(self):
-        FACES = []
-        face_data = self.BSP.lump_t[27]
-        self.data.seek(face_data.fileofs)
-        for _ in range(face_data.filelen//dface_t.size):
-            face = dface_t()
-            face.unpack(self.data.read(face.size))
-            FACES.append(face)
-        self.BSP.LUMPS[27] = FACES
+        faces = self.readStructs(27,dface_t)
+        self.BSP.LUMPS[27] = FaceTable.from_array(faces) if self.use_arrays else faces
 
     def readOrigFaces(self):
-        FACES = []
-        face_data = self.BSP.lump_t[7]
-        self.data.seek(face_data.fileofs)
-        for _ in range(face_data.filelen//dface_t.size):
-            face = dface_t()
-            face.unpack(self.data.read(face.size))
-            FACES.append(face)
-        self.BSP.LUMPS[7] = FACES
+        faces = self.readStructs(7,dface_t)
+        self.BSP.LUMPS[7] = FaceTable.from_array(faces) if self.use_arrays else faces
 
     def readBrushes(self):
-        BRUSHES = []
-        brush_data = self.BSP.lump_t[18]
-        self.data.seek(brush_data.fileofs)
-        for _ in range(brush_data.filelen//dbrush_t.size):
-            brush = dbrush_t()
-            brush.unpack(self.data.read(brush.size))
-            BRUSHES.append(brush)
-        self.BSP.LUMPS[18] = BRUSHES
+        self.BSP.LUMPS[18] = self.readStructs(18,dbrush_t)
     def readBrusheSides(self):
-        BRUSHESIDE = []
-        brushside_data = self.BSP.lump_t[19]
-        self.data.seek(brushside_data.fileofs)
-        for _ in range(brushside_data.filelen//dbrush_t.size):
-            brushside = dbrushside_t()
-            brushside.unpack(self.data.read(brushside.size))
-            BRUSHESIDE.append(brushside)
-        self.BSP.LUMPS[19] = BRUSHESIDE
+        self.BSP.LUMPS[19] = self.readStructs(19,dbrushside_t)
     def readNodes(self):
-        NODES = []
-        node_data = self.BSP.lump_t[5]
-        self.data.seek(node_data.fileofs)
-        for _ in range(node_data.filelen//dnode_t.size):
-            node = dnode_t()
-            node.unpack(self.data.read(node.size))
-            NODES.append(node)
-        self.BSP.LUMPS[5] = NODES
+        self.BSP.LUMPS[5] = self.readStructs(5,dnode_t)
     def readLeafs(self):
-        LEAFS = []
-        leaf_data = self.BSP.lump_t[10]
-        self.data.seek(leaf_data.fileofs)
-        for _ in range(leaf_data.filelen//dleaf_t.size):
-            leaf = dleaf_t()
-            leaf.unpack(self.data.read(leaf.size))
-            LEAFS.append(leaf)
-        self.BSP.LUMPS[10] = LEAFS
+        self.BSP.LUMPS[10] = self.readStructs(10,dleaf_t)
 
     def readLeaffaces(self):
-        LEAFFACE = []
-        leafface_data = self.BSP.lump_t[16]
-        self.data.seek(leafface_data.fileofs)
-        for _ in range(leafface_data.filelen // dleafface_t.size):
-            leafface = dleafface_t()
-            leafface.unpack(self.data.read(leafface.size))
-            LEAFFACE.append(leafface)
-        self.BSP.LUMPS[16] = LEAFFACE
+        self.BSP.LUMPS[16] = self.readStructs(16,dleafface_t)
     def readLeafbrush(self):
-        LEAFBRUSH = []
-        leafbrush_data = self.BSP.lump_t[17]
-        self.data.seek(leafbrush_data.fileofs)
-        for _ in range(leafbrush_data.filelen // dleafbrush_t.size):
-            leafbrush = dleafbrush_t()
-            leafbrush.unpack(self.data.read(leafbrush.size))
-            LEAFBRUSH.append(leafbrush)
-        self.BSP.LUMPS[17] = LEAFBRUSH
+        self.BSP.LUMPS[17] = self.readStructs(17,dleafbrush_t)
     def readTexinfo(self):
         ARRAY = []
-        data = self.BSP.lump_t[6]
-        self.data.seek(data.fileofs,0)
-        for _ in range(data.filelen // texinfo_t.size):
+        for values in self.iter_lump(6,'<16f2i'):
             struct_data = texinfo_t()
-            struct_data.textureVecs = [textureVec.readtextureVec(self.data),textureVec.readtextureVec(self.data)]
-            struct_data.lightmapVecs = [textureVec.readtextureVec(self.data),textureVec.readtextureVec(self.data)]
-            struct_data.flags = self.readInt32()
-            struct_data.texdata = self.readInt32()
+            vecs = []
+            for n in range(4):
+                tVec = textureVec()
+                tVec.x,tVec.y,tVec.z,tVec.offset = values[n*4:n*4+4]
+                vecs.append(tVec)
+            struct_data.textureVecs = vecs[:2]
+            struct_data.lightmapVecs = vecs[2:]
+            struct_data.flags = values[16]
+            struct_data.texdata = values[17]
             ARRAY.append(struct_data)
         self.BSP.LUMPS[6] = ARRAY
     def readTexdata(self):
-        ARRAY = []
-        data = self.BSP.lump_t[2]
-        self.data.seek(data.fileofs,0)
-        for _ in range(data.filelen // dtexdata_t.size):
-            struct_data = dtexdata_t()
-            struct_data.unpack(self.data.read(struct_data.size))
+        ARRAY = list(dtexdata_t.unpack_array(self.lump_data(2)))
+        for struct_data in ARRAY:
             struct_data.__dict__['name'] = self.BSP.LUMPS[43][struct_data.nameStringTableID]
-            ARRAY.append(struct_data)
         self.BSP.LUMPS[2] = ARRAY
 
     def readTexdataStringData(self):
-        ARRAY = []
-        data = self.BSP.lump_t[44]
-        self.data.seek(data.fileofs)
-
-        for _ in range(data.filelen // TexdataStringData.size):
-            struct_data = TexdataStringData()
-            struct_data.unpack(self.data.read(struct_data.size))
-            ARRAY.append(struct_data)
-        self.BSP.LUMPS[44] = ARRAY
+        self.BSP.LUMPS[44] = self.readStructs(44,TexdataStringData)
 
     def TexdataStringTable(self):
-        data = self.BSP.lump_t[43]
-        self.data.seek(data.fileofs)
-        strings = self.data.read(data.filelen).decode().split('\x00')
+        strings = bytes(self.lump_data(43)).decode().split('\x00')
         self.BSP.LUMPS[43] = strings
     def readModel(self):
-        ARRAY = []
-        type_ = dmodel_t
-        data = self.BSP.lump_t[14]
-        self.data.seek(data.fileofs)
-
-        for _ in range(data.filelen // type_.size):
-            struct_data = type_()
-            struct_data.unpack(self.data.read(struct_data.size))
-
-            ARRAY.append(struct_data)
-        self.BSP.LUMPS[14] = ARRAY
+        self.BSP.LUMPS[14] = self.readStructs(14,dmodel_t)
 
     def readEntities(self):
-        data = self.BSP.lump_t[0]
-        self.data.seek(data.fileofs,0)
-        st = self.data.read(data.filelen-1).decode()
-        string = io.StringIO(st)
-
-        kv = KeyValue_parser.KeyValues(string)
+        text = bytes(self.lump_data(0)).rstrip(b'\0').decode('utf-8','replace')
+        self.BSP.LUMPS[0] = list(KeyValue_parser.iter_entities(text))
 
-        self.BSP.LUMPS[0] = kv.dump()
+    # ddispinfo_t record: start position, vertex/triangle start, power, min tesselation, smoothing angle, contents,
+    # map face, lightmap alpha and sample position start, 8 sub neighbors (2 per edge), 4 corner neighbors,
+    # padding and allowed verts
+    DISPINFO_FORMAT = '<3f4ifiH2i' + 'H4b'*8 + '4HB'*4 + '6x10I'
 
     def readDispinfo(self):
         ARRAY = []
-        type_ = ddispinfo_t
-        data = self.BSP.lump_t[26]
-        self.data.seek(data.fileofs)
-
-        for _ in range(data.filelen // type_.size):
-            struct_data = type_()
-            struct_data.startPosition.gen(self.data)
-            struct_data.DispVertStart = self.readInt32()
-            struct_data.DispTriStart = self.readInt32()
-            struct_data.power = self.readInt32()
-            struct_data.minTess = self.readInt32()
-            struct_data.smoothingAngle = self.readFloat()
-            struct_data.contents = self.readInt32()
-            struct_data.MapFace = self.readUInt16()
-            struct_data.LightmapAlphaStart = self.readInt32()
-            struct_data.LightmapSamplePositionStart = self.readInt32()
-            # struct_data.CDispNeighbor = self.readBytes(90)
+        for values in self.iter_lump(26,self.DISPINFO_FORMAT):
+            struct_data = ddispinfo_t()
+            position = struct_data.startPosition
+            position.x,position.y,position.z = [round(v,15) for v in values[:3]]
+            (struct_data.DispVertStart,struct_data.DispTriStart,struct_data.power,struct_data.minTess,
+             struct_data.smoothingAngle,struct_data.contents,struct_data.MapFace,
+             struct_data.LightmapAlphaStart,struct_data.LightmapSamplePositionStart) = values[3:12]
             struct_data.CornerNeighbors = []
-            start = self.data.tell()
+            i = 12
             for _ in range(4):
                 cdn = CDispNeighbor()
                 neib = []
                 for _ in range(2):
                     b = CDispSubNeighbor()
-                    b.iNeighbor = self.readUInt16()
-                    b.NeighborOrientation = self.readByte()
-                    b.Span = self.readByte()
-                    self.readByte()
-                    b.NeighborSpan = self.readByte()
+                    # fourth byte is skipped
+                    b.iNeighbor,b.NeighborOrientation,b.Span,_,b.NeighborSpan = values[i:i+5]
+                    i += 5
                     neib.append(b)
-                cdn.m_SubNeighbors =neib
+                cdn.m_SubNeighbors = neib
                 struct_data.CornerNeighbors.append(cdn)
             for _ in range(4):
                 cdn2 = DisplaceCornerNeighbors()
-                cdn2.neighbor_indices = [self.readUInt16() for _ in range(4)]
-                cdn2.neighbor_count = self.readUByte()
+                cdn2.neighbor_indices = list(values[i:i+4])
+                cdn2.neighbor_count = values[i+4]
+                i += 5
                 struct_data.CornerNeighbors.append(cdn2)
-
-            self.readBytes(6)
-            struct_data.AllowedVerts = [self.readUInt32() for _ in range(10)]
-
-
+            struct_data.AllowedVerts = list(values[i:])
             ARRAY.append(struct_data)
         self.BSP.LUMPS[26] = ARRAY
 
     def readDispVert(self):
         ar = []
-        data = self.BSP.lump_t[LUMP_ENUM.LUMP_DISP_VERTS]
-        self.data.seek(data.fileofs)
-        for _ in range(data.filelen//CDispVert.size):
+        for x,y,z,dist,alpha in self.iter_lump(LUMP_ENUM.LUMP_DISP_VERTS,'<5f'):
             vert = CDispVert()
-            vert.m_vVector.gen(self.data)
-            vert.m_flDist = self.readFloat()
-            vert.m_flAlpha = self.readFloat()
+            vert.m_vVector.x = round(x,15)
+            vert.m_vVector.y = round(y,15)
+            vert.m_vVector.z = round(z,15)
+            vert.m_flDist = dist
+            vert.m_flAlpha = alpha
             ar.append(vert)
         self.BSP.LUMPS[LUMP_ENUM.LUMP_DISP_VERTS] = ar
     def readPak(self):
 
         data = self.BSP.lump_t[40]
-        self.data.seek(data.fileofs)
-        self.PAK = zipfile.ZipFile(io.BytesIO(self.data.read(data.filelen)),'r')
+        with self.profiler.measure('LUMP_PAKFILE',data.filelen,lump = 40) as step:
+            # pak can be hundreds of megabytes, zipfile reads members straight from file through the view
+            self._PAK = zipfile.ZipFile(self.lump_view(40),'r')
+            step['count'] = len(self._PAK.infolist())
         self.data.seek(data.fileofs)
         if __name__ == '__main__':
             with open('test.zip','wb') as zp:
                 zp.write(self.data.read(data.filelen))
 
     def readVertNormals(self):
+        if self.use_arrays:
+            self.BSP.LUMPS[30] = self.readArray(30,VertNormal.dtype)
+            return
         ARRAY = []
         type_ = VertNormal
-        data = self.BSP.lump_t[30]
-        self.data.seek(data.fileofs)
-
-        for _ in range(data.filelen // type_.size):
+        for x,y,z in self.iter_lump(30,'<3f'):
             struct_data = type_()
-            struct_data.x = self.readFloat()
-            struct_data.y = self.readFloat()
-            struct_data.z = self.readFloat()
+            struct_data.x = x
+            struct_data.y = y
+            struct_data.z = z
 
             ARRAY.append(struct_data)
         self.BSP.LUMPS[30] = ARRAY
     def readVertNormalsIndexes(self):
+        if self.use_arrays:
+            self.BSP.LUMPS[31] = self.readArray(31,VertNormal_indexes.dtype)
+            return
         type_ = VertNormal_indexes
-        data = self.BSP.lump_t[31]
-        self.data.seek(data.fileofs)
         struct_data = type_()
-
-        for _ in range(data.filelen // type_.size):
-            struct_data.indexes.append(self.readInt16())
+        struct_data.indexes = [index for index, in self.iter_lump(31,'<H')]
 
         self.BSP.LUMPS[31] = struct_data
 
     def readWorldLights(self):
-        data = self.BSP.lump_t[LUMP_ENUM.LUMP_WORLDLIGHTS]
-        print(data)
         ar = []
-        self.data.seek(data.fileofs)
-        for i in range(data.filelen//100):
-            start = self.data.tell()
+        # origin, intensity, normal, cluster, 3 unused ints, type, style, 7 floats, flags, texinfo, owner
+        for values in self.iter_lump(LUMP_ENUM.LUMP_WORLDLIGHTS,'<9f4i2i7f3i'):
             worldlight = dworldlight_t()
-            worldlight.origin.gen(self.data)
-            worldlight.intensity.gen(self.data)
-            worldlight.normal.gen(self.data)
-            worldlight.cluster = self.readInt32()
-            self.readInt32()
-            self.readInt32()
-            self.readInt32()
-            worldlight.type = self.readInt32()
-            worldlight.style = self.readInt32()
-            worldlight.stopdot = self.readFloat()
-            worldlight.stopdot2 = self.readFloat()
-            worldlight.exponent = self.readFloat()
-            worldlight.radius = self.readFloat()
-            worldlight.constant_attn = self.readFloat()
-            worldlight.linear_attn = self.readFloat()
-            worldlight.quadratic_attn = self.readFloat()
-            worldlight.flags = self.readInt32()
-            worldlight.texinfo = self.readInt32()
-            worldlight.owner = self.readInt32()
+            worldlight.origin.x,worldlight.origin.y,worldlight.origin.z = [round(v,15) for v in values[0:3]]
+            intensity = worldlight.intensity
+            intensity.r,intensity.g,intensity.b = values[3:6]
+            worldlight.normal.x,worldlight.normal.y,worldlight.normal.z = [round(v,15) for v in values[6:9]]
+            worldlight.cluster = values[9]
+            (worldlight.type,worldlight.style,worldlight.stopdot,worldlight.stopdot2,worldlight.exponent,
+             worldlight.radius,worldlight.constant_attn,worldlight.linear_attn,worldlight.quadratic_attn,
+             worldlight.flags,worldlight.texinfo,worldlight.owner) = values[13:]
             ar.append(worldlight)
-            # pprint(worldlight.__dict__)
         self.BSP.LUMPS[LUMP_ENUM.LUMP_WORLDLIGHTS] = ar
 
-
-
-
     def readdgamelumpheader_t(self):
-        data = self.BSP.lump_t[LUMP_ENUM.LUMP_GAME_LUMP]
-
-        self.data.seek(data.fileofs)
+        data = self.lump_data(LUMP_ENUM.LUMP_GAME_LUMP)
         gamelumpheader = dgamelumpheader_t()
-        gamelumpheader.lumpCount = self.readInt32()
-
-        for n in range(gamelumpheader.lumpCount): #type: dgamelump_t
+        gamelumpheader.lumpCount, = struct.unpack_from('<i',data)
+        for values in struct.iter_unpack('<iHHii',data[4:4+gamelumpheader.lumpCount*16]):
             gameLump = dgamelump_t()
-            gameLump.id = self.readInt32()
-            gameLump.flags = self.readUInt16()
-            gameLump.version = self.readUInt16()
-            gameLump.fileofs = self.readInt32()
-            gameLump.filelen = self.readInt32()
+            gameLump.id,gameLump.flags,gameLump.version,gameLump.fileofs,gameLump.filelen = values
             gamelumpheader.gamelump.append(gameLump)
         self.BSP.LUMPS[LUMP_ENUM.LUMP_GAME_LUMP] = gamelumpheader
 
@@ -508,107 +586,142 @@ class BSPreader:
         data = self.BSP.LUMPS[LUMP_ENUM.LUMP_GAME_LUMP].gamelump
         for gameL in data: #type: dgamelump_t
             if gameL.id == 1936749168:
-                self.data.seek(gameL.fileofs)
+                lump = self.read_data(gameL.fileofs,gameL.filelen)
                 StaticPropDict = StaticPropDictLump_t()
-                StaticPropDict.dictEntries = self.readInt32()
+                StaticPropDict.dictEntries, = struct.unpack_from('<i',lump)
+                offset = 4
                 for i in range(StaticPropDict.dictEntries):
-                    StaticPropDict.name.append(self.readNullString(128))
+                    name = bytes(lump[offset:offset+128]).split(b'\0',1)[0]
+                    StaticPropDict.name.append(name.decode('latin-1'))
+                    offset += 128
                 gameL.PropDict = StaticPropDict
                 StaticPropLeaf = StaticPropLeafLump_t()
-                StaticPropLeaf.leafEntries = self.readInt32()
-                for i in range(StaticPropLeaf.leafEntries):
-                    StaticPropLeaf.leaf.append(self.readInt16())
+                StaticPropLeaf.leafEntries, = struct.unpack_from('<i',lump,offset)
+                offset += 4
+                StaticPropLeaf.leaf = list(struct.unpack_from('<{}h'.format(StaticPropLeaf.leafEntries),lump,offset))
+                offset += StaticPropLeaf.leafEntries*2
                 gameL.PropLeaf = StaticPropLeaf
-                PropNumber = self.readInt32()
-                for i in range(PropNumber):
-                    gameL.PropData.append(self.readStaticProp(gameL))
-    def readStaticProp(self,GameLump:dgamelump_t):
-        StaticProp = StaticPropLump_t()
-        if GameLump.version>=4:
-            StaticProp.Origin.gen(self.data)
-            StaticProp.Angles.gen(self.data)
-            StaticProp.PropType = self.readUInt16()
-            StaticProp.FirstLeaf = self.readUInt16()
-            StaticProp.LeafCount = self.readUInt16()
-            StaticProp.Solid = self.readUByte()
-            StaticProp.Flags = self.readUByte()
-            StaticProp.Skin = self.readInt32()
-            StaticProp.FadeMinDist = self.readFloat()
-            StaticProp.FadeMaxDist = self.readFloat()
-            StaticProp.LightingOrigin.gen(self.data)
-        if GameLump.version>=5:
-            StaticProp.FadeMaxDist = self.readFloat()
-        if GameLump.version == 6 or GameLump.version == 7:
-            StaticProp.MinDXLevel = self.readUInt16()
-            StaticProp.MaxDXLevel = self.readUInt16()
-        if GameLump.version >= 8:
-            StaticProp.MinCPULevel = self.readUByte()
-            StaticProp.MaxCPULevel = self.readUByte()
-            StaticProp.MinGPULevel = self.readUByte()
-            StaticProp.MaxGPULevel = self.readUByte()
-        if GameLump.version >= 7:
-            color = color32()
-            color.r = self.readUByte()
-            color.g = self.readUByte()
-            color.b = self.readUByte()
-            color.a = self.readUByte()
-            StaticProp.DiffuseModulation = color
-        if GameLump.version >= 10:
-            StaticProp.unknown = self.readFloat()
-        if GameLump.version >= 9:
-            StaticProp.DisableX360 = self.readUInt32()
-
-        return StaticProp
+                PropNumber, = struct.unpack_from('<i',lump,offset)
+                offset += 4
+                gameL.PropData = self.readStaticProps(gameL,lump[offset:],PropNumber)
+
+    @staticmethod
+    def staticPropLayout(version):
+        """
+        Returns struct format and field names of static prop record of game lump version.
+        Origin, Angles and LightingOrigin take 3 values, DiffuseModulation 4
+        """
+        fmt = '<'
+        fields = []
+        if version>=4:
+            fmt += '6f3H2Bi2f3f'
+            fields += ['Origin','Angles','PropType','FirstLeaf','LeafCount','Solid','Flags','Skin',
+                       'FadeMinDist','FadeMaxDist','LightingOrigin']
+        if version>=5:
+            # ForcedFadeScale, reader always stored it over FadeMaxDist
+            fmt += 'f'
+            fields.append('FadeMaxDist')
+        if version == 6 or version == 7:
+            fmt += '2H'
+            fields += ['MinDXLevel','MaxDXLevel']
+        if version >= 8:
+            fmt += '4B'
+            fields += ['MinCPULevel','MaxCPULevel','MinGPULevel','MaxGPULevel']
+        if version >= 7:
+            fmt += '4B'
+            fields.append('DiffuseModulation')
+        if version >= 10:
+            fmt += 'f'
+            fields.append('unknown')
+        if version >= 9:
+            fmt += 'I'
+            fields.append('DisableX360')
+        return fmt,fields
+
+    def readStaticProps(self,GameLump:dgamelump_t,data,count):
+        """Decodes count static prop records of GameLump version from start of data"""
+        fmt,fields = self.staticPropLayout(GameLump.version)
+        size = struct.calcsize(fmt)
+        if not size:
+            return [StaticPropLump_t() for _ in range(count)]
+        props = []
+        for values in struct.iter_unpack(fmt,data[:count*size]):
+            StaticProp = StaticPropLump_t()
+            i = 0
+            for field in fields:
+                if field == 'Origin' or field == 'Angles' or field == 'LightingOrigin':
+                    vector = getattr(StaticProp,field)
+                    vector.x,vector.y,vector.z = [round(v,15) for v in values[i:i+3]]
+                    i += 3
+                elif field == 'DiffuseModulation':
+                    color = color32()
+                    color.r,color.g,color.b,color.a = values[i:i+4]
+                    StaticProp.DiffuseModulation = color
+                    i += 4
+                else:
+                    setattr(StaticProp,field,values[i])
+                    i += 1
+            props.append(StaticProp)
+        return props
+
+    def mountFileSystem(self):
+        """Mounts map pak on top of filesystem of gameinfo search paths, which is shared between maps"""
+        fs = vfs.VirtualFileSystem(self.gameInfo.filesystem(self.index_cache) if self.gameInfo else None)
+        if self.BSP.lump_t[40].filelen:
+            fs.mount_pak(self.PAK,os.path.basename(self.file.name))
+        return fs
+
+    @property
+    def vfs(self):
+        if self._vfs is None:
+            self._vfs = self.mountFileSystem()
+        return self._vfs
 
     def findFiles(self, model_path:str,type_:str = ''):
+        """
+        Returns (kind, path on disk) of file, kind is 'PAK', 'VPK' or 'FILE' depending on where it was found.
+        Files from map pak and VPK archives are extracted by extractFile, so path is always real file.
+        """
         model_path = type_ + model_path
-        # if model_path.lower() in self.PAK.namelist():
-        #     return 'PAK',model_path
-
-        for game in self.gameInfo:
-            if game == '|gameinfo_path|.':
-                if os.path.isfile(os.path.join(self.gameInfo_path,model_path)):
-                    return 'FILE',os.path.join(self.gameInfo_path,model_path)
-            else:
-                if os.path.isfile(os.path.join(self.gameInfo_path,'..',game,model_path)):
-                    return 'FILE', os.path.join(self.gameInfo_path,'..',game,model_path)
+        found = self.vfs.find(model_path)
+        if found is not None:
+            layer, location = found
+            if layer.kind == 'FILE':
+                return layer.kind,location
+            return layer.kind,self.extractFile(model_path,layer,location)
         print('Can\'t find',model_path)
         return 'ERROR','ERROR'
+    def extractFile(self,path,layer,location):
+        """
+        Copies file from pak or VPK layer into temporary directory of this reader and returns its path,
+        directory is removed by finish()
+        """
+        if self._extract_dir is None:
+            self._extract_dir = tempfile.mkdtemp(prefix = 'bsp_')
+        target = os.path.join(self._extract_dir,*vfs.normalize_path(path).split('/'))
+        if not os.path.isfile(target):
+            os.makedirs(os.path.dirname(target),exist_ok = True)
+            with layer.open(location) as source, open(target,'wb') as output:
+                shutil.copyfileobj(source,output)
+        return target
     def getStaticPropsFile(self,model_path):
         FILES = {}
-
-        type_, path = self.findFiles(model_path)
-        if type_ == 'ERROR':
+        fs = self.vfs
+        if model_path not in fs:
+            print('Can\'t find',model_path)
             return 'ERROR'
-        # if type_ == 'PAK':
-        #     MDL = self.PAK.open(path,'r')
-        #     VVD = self.PAK.open(path.replace('.MDL','.VVD'),'r')
-        #     FILES['VVD'] = VVD
-        #     FILES['MDL'] = MDL
-        #     try:
-        #         VTX = self.PAK.open(path.replace('.MDL','.dx90.vtx'),'r')
-        #     except:
-        #         try:
-        #             VTX = self.PAK.open(path.replace('.MDL','.VTX'),'r')
-        #         except:
-        #             return 'ERROR'
-        #     FILES['VTX'] = VTX
-        #     return FILES
+        base = os.path.splitext(model_path)[0]
+        for vtx in (base+'.dx90.vtx',base+'.vtx'):
+            if vtx in fs:
+                break
         else:
-
-            MDL = open(path,'rb')
-            VVD = open(path.replace('.MDL', '.VVD'),'rb')
-            try:
-                VTX = open(path.replace('.MDL','.dx90.vtx'),'rb')
-            except:
-                try:
-                    VTX = open(path.replace('.MDL','.VTX'),'rb')
-                except:
-                    return 'ERROR'
-            FILES['VVD'] = VVD
-            FILES['MDL'] = MDL
-            FILES['VTX'] = VTX
-            return FILES
+            return 'ERROR'
+        if base+'.vvd' not in fs:
+            return 'ERROR'
+        FILES['MDL'] = fs.open(model_path)
+        FILES['VVD'] = fs.open(base+'.vvd')
+        FILES['VTX'] = fs.open(vtx)
+        return FILES
     def getTextureFile(self,tex_path):
         if tex_path.startswith('maps/'):
             path = os.path.join(*tex_path.split('/')[2:-1])
@@ -616,11 +729,26 @@ class BSPreader:
             tex_path = '_'.join(tex_path.split('_')[:-3])
             tex_path = os.path.join(path,tex_path).replace('\\','/')
 
+        # path on disk, .vmt from pak or VPK is extracted (see findFiles)
         type_, path = self.findFiles(tex_path+'.vmt','materials/')
         return path if type_!='ERROR' else None
+    @property
+    def PAK(self):
+        if self._PAK is None:
+            self.readPak()
+        return self._PAK
+
     def finish(self):
-        self.PAK.close()
-        del self.PAK
+        if self._PAK is not None:
+            # zipfile doesn't close file objects it was given
+            view = self._PAK.fp
+            self._PAK.close()
+            if view is not None:
+                view.close()
+            self._PAK = None
+        if self._extract_dir is not None:
+            shutil.rmtree(self._extract_dir,ignore_errors = True)
+            self._extract_dir = None
 
 
 import sys
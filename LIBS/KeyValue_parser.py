@@ -1,10 +1,66 @@
 import io
 import re
 from pprint import pprint
-isfloat = lambda x: x.replace('.','',1).isdigit() and "." in x
+
+# quoted string, comment, brace, platform conditional ([$WIN32] in gameinfo.txt) or bare word,
+# leading whitespace is consumed with the token. Comments and conditionals have no group, so they are skipped.
+# KeyValues files have no escape sequences, backslash is plain character of paths like "models\props\"
+token_regex = re.compile(r'\s*(?:"([^"]*)"|//[^\n]*|([{}])|\[[^\]\n]*\]|([^\s{}"]+))')
+_number = r'-?(?:\d+\.?\d*|\.\d+)'
+int_regex = re.compile(r'-?\d+$')
+float_regex = re.compile(_number + '$')
+vector_regex = re.compile('{0} {0} {0}$'.format(_number))
+
+
+def convert_value(value):
+    """Converts numeric values to int or float and "x y z" triples to list of floats, other values are kept as strings"""
+    if vector_regex.match(value):
+        return list(map(float, value.split(' ')))
+    if int_regex.match(value):
+        return int(value)
+    if float_regex.match(value):
+        return float(value)
+    return value
+
+
+def iter_entities(text, convert=True):
+    """
+    Yields dict of key values for each top level {} block of text (entity lump syntax).
+    Text is tokenized in a single pass, so braces, // and backslashes inside quoted values are kept as is.
+    Nested blocks are stored as dict values, later duplicate keys override earlier ones.
+    """
+    stack = []
+    key = None
+    for match in token_regex.finditer(text):
+        quoted, brace, bare = match.groups()
+        if brace == '{':
+            block = {}
+            if stack and key is not None:
+                stack[-1][key] = block
+            stack.append(block)
+            key = None
+        elif brace == '}':
+            if stack:
+                block = stack.pop()
+                if not stack:
+                    yield block
+            key = None
+        elif quoted is not None or bare is not None:
+            if not stack:
+                # text outside of blocks
+                continue
+            token = quoted if quoted is not None else bare
+            if key is None:
+                key = token
+            else:
+                stack[-1][key] = convert_value(token) if convert else token
+                key = None
+    # unterminated last block
+    if stack:
+        yield stack[0]
+
 
 class KeyValues:
-    kv_regex = re.compile('\"(?P<key>[a-zA-z_|0-9]+)\" ? \"(?P<value>[a-zA-z_| 0-9-./*]+|\"?)\"')
 
     def __init__(self,file:io.TextIOWrapper):
         self.data = file.read()
@@ -13,37 +69,12 @@ class KeyValues:
 
 
     def parse(self):
-        while len(self.data)>50:
-            open_ = self.data.find('{')+1
-            close_ = self.data.find('}')
-            local_data = self.data[open_:close_].strip()
-            local_holder = {}
-            for line in local_data.split('\n'):
-                kv = self.kv_regex.search(line)
-                if kv is None:
-                    continue
-                key = kv.group('key')
-                value = kv.group('value')
-                # print(key,value)
-                if kv.group('value').split(' ').__len__() == 3:
-                    value = kv.group('value').split(' ')
-                    if map(lambda a:a.replace('.','',1).isnumeric(),value):
-                        if map(lambda a:isfloat(a),value):
-                            value = list(map(float,value))
-                        else:
-                            value = list(map(int,value))
-                elif value.replace('.','',1).isnumeric():
-                    if isfloat(value):
-                        value = float(value)
-                    else:
-                        value = int(value)
-                local_holder[key] = value
-            self.holder.append(local_holder)
-            self.data = self.data[close_+1:]
+        self.holder = list(iter_entities(self.data))
+
     def dump(self):
         return self.holder
 
 
 if __name__ == '__main__':
     a = KeyValues(open('../kv.kv','r'))
-    pprint(a.dump())
\ No newline at end of file
+    pprint(a.dump())
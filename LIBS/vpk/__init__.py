@@ -1,7 +1,14 @@
+import mmap
 import struct
-from binascii import crc32
+import threading
+from array import array
+from bisect import bisect_left
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor, as_completed
+# zlib releases the GIL while hashing large buffers, binascii does not
+from zlib import crc32
 from hashlib import md5
-from io import FileIO
+import io
 from io import open as fopen
 import os
 import sys
@@ -94,74 +101,127 @@ class NewVPK(object):
         return tree_length + 1
 
 
-    def save(self, vpk_output_path):
+    def save(self, vpk_output_path, archive_size=None, workers=4, chunk_size=2**20, batch_size=2**24):
         """
         Saves the VPK at the given path
+
+        Without archive_size all file data is embedded in the single file. Otherwise it is split
+        into numbered archives of up to archive_size bytes next to vpk_output_path, which then has to end with _dir.vpk.
+
+        Every file is assigned its place up front, then batches of neighbouring files are streamed
+        in chunk_size pieces by a pool of worker threads, computing CRC32 on the way,
+        so memory use doesn't depend on input size. The directory tree is written last.
         """
+        if archive_size is not None and not vpk_output_path.endswith("_dir.vpk"):
+            raise ValueError("Multi-archive VPK path has to end with _dir.vpk: %s" % repr(vpk_output_path))
+
+        data_offset = self.header_length + self.tree_length
+
+        # layout: (source path, archive index, archive offset, file length), in tree order
+        entries = []
+        archive_index = 0x7fff if archive_size is None else 0
+        archive_offset = 0
+        archive_lengths = {}
+
+        for ext in self.tree:
+            for relpath in self.tree[ext]:
+                for filename in self.tree[ext][relpath]:
+                    real_filename = filename if not ext else "{0}.{1}".format(filename, ext)
+                    source = os.path.join(self.path, '' if relpath == ' ' else relpath, real_filename)
+                    file_length = os.path.getsize(source)
+
+                    if archive_size is not None and archive_offset and archive_offset + file_length > archive_size:
+                        archive_index += 1
+                        archive_offset = 0
+
+                    entries.append((source, archive_index, archive_offset, file_length))
+                    archive_offset += file_length
+                    archive_lengths[archive_index] = archive_offset
+
+        # batches of files laid out back to back in one archive, each is written sequentially
+        batches = []
+        batch_length = 0
+        for entry in entries:
+            if batches and batches[-1][-1][1] == entry[1] and batch_length + entry[3] <= batch_size:
+                batches[-1].append(entry)
+                batch_length += entry[3]
+            else:
+                batches.append([entry])
+                batch_length = entry[3]
+
+        # create all outputs at full size, so workers can fill them in any order
         with fopen(vpk_output_path, 'wb') as f:
-            # write VPK1 header
-            f.write(struct.pack("3I", self.signature,
-                                      self.version,
-                                      self.tree_length))
-
-            self.header_length = f.tell()
-
-            data_offset = self.header_length + self.tree_length
-
-            # write file tree
-            for ext in self.tree:
-                f.write("{0}\x00".format(ext).encode('latin-1'))
-
-                for relpath in self.tree[ext]:
-                    f.write("{0}\x00".format(relpath).encode('latin-1'))
-
-                    for filename in self.tree[ext][relpath]:
-                        f.write("{0}\x00".format(filename).encode('latin-1'))
-
-                        # append file data
-                        metadata_offset = f.tell()
-                        file_offset = data_offset
-                        real_filename = filename if not ext else "{0}.{1}".format(filename, ext)
-                        checksum = 0
-                        f.seek(data_offset)
-
-                        with fopen(os.path.join(self.path,
-                                                '' if relpath == ' ' else relpath,
-                                                real_filename
-                                                ),
-                                   'rb') as pakfile:
-                            for chunk in iter(lambda: pakfile.read(1024), b''):
-                                checksum = crc32(chunk, checksum)
-                                f.write(chunk)
-
-                        data_offset = f.tell()
-                        file_length = f.tell() - file_offset
-                        f.seek(metadata_offset)
-
-                        # metadata
-
-                        # crc32
-                        # preload_length
-                        # archive_index
-                        # archive_offset
-                        # file_length
-                        # suffix
-                        f.write(struct.pack("IHHIIH", checksum & 0xFFffFFff,
-                                                      0,
-                                                      0x7fff,
-                                                      file_offset - self.tree_length - self.header_length,
-                                                      file_length,
-                                                      0xffff
-                                                      ))
-
-
-                    # next relpath
-                    f.write(b"\x00")
-                # next ext
-                f.write(b"\x00")
-            # end of file tree
-            f.write(b"\x00")
+            f.truncate(data_offset + archive_lengths.get(0x7fff, 0))
+        for index, length in archive_lengths.items():
+            if index != 0x7fff:
+                with fopen(_archive_path(vpk_output_path, index), 'wb') as f:
+                    f.truncate(length)
+
+        def copy_batch(batch):
+            checksums = []
+            buffer = bytearray(chunk_size)
+            view = memoryview(buffer)
+            index, offset = batch[0][1], batch[0][2]
+
+            with fopen(_archive_path(vpk_output_path, index), 'r+b') as output:
+                output.seek(offset + (data_offset if index == 0x7fff else 0))
+
+                for source, _, _, file_length in batch:
+                    checksum = 0
+                    copied = 0
+                    with fopen(source, 'rb') as pakfile:
+                        for length in iter(lambda: pakfile.readinto(buffer), 0):
+                            checksum = crc32(view[:length], checksum)
+                            output.write(view[:length])
+                            copied += length
+
+                    if copied != file_length:
+                        raise RuntimeError("File changed while saving: {0}".format(repr(source)))
+
+                    checksums.append(checksum & 0xFFffFFff)
+
+            return checksums
+
+        checksums = []
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            for batch_checksums in pool.map(copy_batch, batches):
+                checksums.extend(batch_checksums)
+
+        # header and file tree, entries are in the same order as tree
+        tree = bytearray(struct.pack("3I", self.signature, self.version, self.tree_length))
+        metadata = iter(zip(checksums, entries))
 
+        for ext in self.tree:
+            tree += "{0}\x00".format(ext).encode('latin-1')
+
+            for relpath in self.tree[ext]:
+                tree += "{0}\x00".format(relpath).encode('latin-1')
+
+                for filename in self.tree[ext][relpath]:
+                    tree += "{0}\x00".format(filename).encode('latin-1')
+
+                    checksum, (_, archive_index, archive_offset, file_length) = next(metadata)
+
+                    # crc32, preload_length, archive_index, archive_offset, file_length, suffix
+                    tree += struct.pack("IHHIIH", checksum,
+                                                  0,
+                                                  archive_index,
+                                                  archive_offset,
+                                                  file_length,
+                                                  0xffff
+                                                  )
+
+                # next relpath
+                tree += b"\x00"
+            # next ext
+            tree += b"\x00"
+        # end of file tree
+        tree += b"\x00"
+
+        assert len(tree) == data_offset, "Tree length mismatch"
+
+        with fopen(vpk_output_path, 'r+b') as f:
+            f.write(tree)
 
     def save_and_open(self, path):
         """
@@ -171,19 +231,407 @@ class NewVPK(object):
         return VPK(path)
 
 
-def _read_cstring(f):
-    buf = b''
+# crc32, preload_length, archive_index, archive_offset, file_length, suffix
+_entry_struct = struct.Struct("<IHHIIH")
+
 
-    for chunk in iter(lambda: f.read(64), b''):
-        pos = chunk.find(b'\x00')
-        if pos > -1:
-            buf += chunk[:pos]
-            f.seek(f.tell() - (len(chunk) - (pos + 1)))
+def _iter_tree(tree, data_offset):
+    """
+    Parses raw directory tree, yields (path, crc32, preload_offset, preload_length,
+    archive_index, archive_offset, file_length). Preload offset points into tree.
+    Offset of files stored in the _dir.vpk itself is made absolute with data_offset.
+    """
+    tree_end = len(tree)
+    entry_size = _entry_struct.size
+    unpack_entry = _entry_struct.unpack_from
+    find = tree.find
+    pos = 0
+
+    while True:
+        end = find(b'\x00', pos)
+        if end == -1:
+            raise ValueError("Error parsing index (out of bounds)")
+        ext = tree[pos:end].decode('ascii')
+        pos = end + 1
+        if ext == '':
             break
 
-        buf += chunk
+        while True:
+            end = find(b'\x00', pos)
+            if end == -1:
+                raise ValueError("Error parsing index (out of bounds)")
+            path = tree[pos:end].decode('ascii')
+            pos = end + 1
+            if path == '':
+                break
+            if path != ' ':
+                path += '/'
+            else:
+                path = ''
+
+            while True:
+                end = find(b'\x00', pos)
+                if end == -1:
+                    raise ValueError("Error parsing index (out of bounds)")
+                if end == pos:
+                    pos += 1
+                    break
+                name = tree[pos:end].decode('ascii')
+                pos = end + 1 + entry_size
+
+                if pos > tree_end:
+                    raise ValueError("Error parsing index (out of bounds)")
+
+                (crc32,
+                 preload_length,
+                 archive_index,
+                 archive_offset,
+                 file_length,
+                 suffix,
+                 ) = unpack_entry(tree, end + 1)
+
+                if suffix != 0xffff:
+                    raise ValueError("Error while parsing index")
+
+                if archive_index == 0x7fff:
+                    archive_offset += data_offset
+
+                yield (path + name + '.' + ext,
+                       crc32,
+                       pos,
+                       preload_length,
+                       archive_index,
+                       archive_offset,
+                       file_length,
+                       )
+                pos += preload_length
+
+
+def _archive_path(vpk_path, archive_index):
+    """
+    Returns path of the archive holding file data, 0x7fff means the data is stored in the _dir.vpk itself
+    """
+    if archive_index == 0x7fff:
+        return vpk_path
+    return vpk_path.replace("dir.", "%03d." % archive_index)
+
+
+def _map_archive(path):
+    with fopen(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# archive_index, archive_offset, length, md5 digest
+_chunk_hash_struct = struct.Struct("<III16s")
+
+# order of values in metadata tuples
+_META_KEYS = ('preload',
+              'crc32',
+              'preload_length',
+              'archive_index',
+              'archive_offset',
+              'file_length',
+              )
+
+# typecodes of VPKIndex columns: crc32, preload offset, preload length, archive index, archive offset, file length
+_COLUMN_TYPES = 'IIHHII'
+
+# on-disk VPKIndex: magic, format version, little endian flag, column item sizes,
+# source size, source mtime, source tree checksum, entry count, paths length, tree length
+_CACHE_MAGIC = b'VPKI'
+_CACHE_VERSION = 1
+_cache_header = struct.Struct("<4sIB6sQQ16sIII")
+
+
+def _prefix_end(prefix):
+    """
+    Returns the smallest string greater than every string starting with prefix
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _glob_prefix(pattern):
+    """
+    Returns literal part of glob pattern before the first wildcard
+    """
+    for i, char in enumerate(pattern):
+        if char in '*?[':
+            return pattern[:i]
+    return pattern
+
+
+def _itemsizes():
+    return bytes(bytearray(array(typecode).itemsize for typecode in _COLUMN_TYPES))
+
+
+class VPKIndex(object):
+    """
+    Compact read-only mapping of file path to metadata tuple, used as VPK.tree
+
+    Paths are kept in one sorted list, metadata in parallel integer arrays,
+    lookups use binary search. Preload bytes are sliced from the tree buffer on access.
+    """
+
+    def __init__(self, paths, crc32s, preload_offsets, preload_lengths,
+                 archive_indexes, archive_offsets, file_lengths, buffer):
+        self.paths = paths
+        self.crc32s = crc32s
+        self.preload_offsets = preload_offsets
+        self.preload_lengths = preload_lengths
+        self.archive_indexes = archive_indexes
+        self.archive_offsets = archive_offsets
+        self.file_lengths = file_lengths
+        # raw directory tree, preload data is sliced from it
+        self.buffer = buffer
+        # extension -> positions of entries, built on first extension query
+        self.extensions = None
+
+    @classmethod
+    def from_tree(cls, tree, data_offset):
+        """
+        Builds the index from raw directory tree
+        """
+        paths = []
+        (crc32s,
+         preload_offsets,
+         preload_lengths,
+         archive_indexes,
+         archive_offsets,
+         file_lengths,
+         ) = [array(typecode) for typecode in _COLUMN_TYPES]
+
+        for (path,
+             crc32,
+             preload_offset,
+             preload_length,
+             archive_index,
+             archive_offset,
+             file_length,
+             ) in _iter_tree(tree, data_offset):
+            paths.append(path)
+            crc32s.append(crc32)
+            preload_offsets.append(preload_offset)
+            preload_lengths.append(preload_length)
+            archive_indexes.append(archive_index)
+            archive_offsets.append(archive_offset)
+            file_lengths.append(file_length)
+
+        # tree is grouped by extension, reorder everything by path for binary search
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+        columns = [crc32s, preload_offsets, preload_lengths, archive_indexes, archive_offsets, file_lengths]
+        columns = [array(column.typecode, [column[i] for i in order]) for column in columns]
+
+        return cls([paths[i] for i in order], *(columns + [tree]))
+
+    def save(self, path, key):
+        """
+        Writes the index to path, key identifies the source _dir.vpk (see VPK.index_key)
+        """
+        paths = "\x00".join(self.paths).encode('ascii')
+        columns = self.columns()
+        header = _cache_header.pack(_CACHE_MAGIC,
+                                    _CACHE_VERSION,
+                                    sys.byteorder == 'little',
+                                    _itemsizes(),
+                                    key[0],
+                                    key[1],
+                                    key[2],
+                                    len(self.paths),
+                                    len(paths),
+                                    len(self.buffer),
+                                    )
+
+        # write to a temporary file first, so readers never see a partial index
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with fopen(tmp_path, 'wb') as f:
+            f.write(header)
+            for column in columns:
+                column.tofile(f)
+            f.write(paths)
+            f.write(self.buffer)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, key):
+        """
+        Reads the index saved by save(), raises ValueError when it is invalid or was saved for a different key
+        """
+        with fopen(path, 'rb') as f:
+            data = f.read()
+
+        if len(data) < _cache_header.size:
+            raise ValueError("Index cache is truncated")
+
+        (magic,
+         version,
+         little_endian,
+         itemsizes,
+         size,
+         mtime,
+         checksum,
+         count,
+         paths_length,
+         tree_length,
+         ) = _cache_header.unpack_from(data)
+
+        if (magic != _CACHE_MAGIC or version != _CACHE_VERSION or
+                little_endian != (sys.byteorder == 'little') or itemsizes != _itemsizes()):
+            raise ValueError("Index cache has incompatible format")
+        if (size, mtime, checksum) != tuple(key):
+            raise ValueError("Index cache is stale")
+
+        pos = _cache_header.size
+        columns = []
+        for typecode in _COLUMN_TYPES:
+            column = array(typecode)
+            length = count * column.itemsize
+            column.frombytes(data[pos:pos+length])
+            columns.append(column)
+            pos += length
+
+        paths = data[pos:pos+paths_length].decode('ascii').split("\x00") if count else []
+        pos += paths_length
+        buffer = data[pos:pos+tree_length]
+
+        if len(paths) != count or len(buffer) != tree_length:
+            raise ValueError("Index cache is truncated")
+
+        return cls(paths, *(columns + [buffer]))
+
+    def columns(self):
+        return [self.crc32s,
+                self.preload_offsets,
+                self.preload_lengths,
+                self.archive_indexes,
+                self.archive_offsets,
+                self.file_lengths,
+                ]
+
+    def __repr__(self):
+        return "%s(%d entries)" % (self.__class__.__name__, len(self))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __contains__(self, path):
+        return self.find(path) != -1
+
+    def __getitem__(self, path):
+        i = self.find(path)
+        if i == -1:
+            raise KeyError(path)
+        return self.metadata(i)
+
+    def find(self, path):
+        """
+        Returns position of path in the index, or -1
+        """
+        i = bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            return i
+        return -1
+
+    def prefix_range(self, prefix, lo=0, hi=None):
+        """
+        Returns (start, end) positions of paths starting with prefix
+        """
+        if hi is None:
+            hi = len(self.paths)
+        if not prefix:
+            return lo, hi
+        return (bisect_left(self.paths, prefix, lo, hi),
+                bisect_left(self.paths, _prefix_end(prefix), lo, hi),
+                )
+
+    def iter_prefix(self, prefix):
+        """
+        Yields paths starting with prefix, in sorted order
+        """
+        start, end = self.prefix_range(prefix)
+        for i in range(start, end):
+            yield self.paths[i]
+
+    def listdir(self, path=''):
+        """
+        Returns names of files and subdirectories (ending with /) directly in directory path
+
+        Subdirectories are skipped with binary search, so the cost depends on the size of the listing, not of the index
+        """
+        prefix = path.strip('/')
+        if prefix:
+            prefix += '/'
+        names = []
+        paths = self.paths
+        i, end = self.prefix_range(prefix)
+
+        while i < end:
+            name = paths[i][len(prefix):]
+            slash = name.find('/')
+            if slash == -1:
+                names.append(name)
+                i += 1
+            else:
+                name = name[:slash+1]
+                names.append(name)
+                i = self.prefix_range(prefix + name, i, end)[1]
+
+        return names
+
+    def glob(self, pattern):
+        """
+        Yields paths matching fnmatch style pattern, only paths sharing its literal prefix are tested
+        """
+        start, end = self.prefix_range(_glob_prefix(pattern))
+        for i in range(start, end):
+            if fnmatchcase(self.paths[i], pattern):
+                yield self.paths[i]
+
+    def with_extension(self, ext):
+        """
+        Yields paths of files with extension ext (without dot), in sorted order
+        """
+        extensions = self.extensions
+        if extensions is None:
+            extensions = {}
+            for i, path in enumerate(self.paths):
+                extensions.setdefault(path[path.rfind('.')+1:], array('I')).append(i)
+            self.extensions = extensions
+
+        for i in extensions.get(ext.lstrip('.'), ()):
+            yield self.paths[i]
+
+    def metadata(self, i):
+        """
+        Returns metadata tuple of entry at position i
+        """
+        offset = self.preload_offsets[i]
+        length = self.preload_lengths[i]
+        return (self.buffer[offset:offset+length],
+                self.crc32s[i],
+                length,
+                self.archive_indexes[i],
+                self.archive_offsets[i],
+                self.file_lengths[i],
+                )
+
+    def get(self, path, default=None):
+        i = self.find(path)
+        return default if i == -1 else self.metadata(i)
+
+    def keys(self):
+        return iter(self.paths)
+
+    def values(self):
+        for i in range(len(self.paths)):
+            yield self.metadata(i)
+
+    def items(self):
+        for i, path in enumerate(self.paths):
+            yield path, self.metadata(i)
 
-    return buf.decode('ascii')
 
 class VPK(object):
     """
@@ -194,10 +642,15 @@ class VPK(object):
     tree_length = 0
     header_length = 0
 
-    def __init__(self, vpk_path, read_header_only=True):
+    def __init__(self, vpk_path, read_header_only=True, index_cache=None):
         # header
         self.tree = None
         self.vpk_path = vpk_path
+        # directory where parsed indexes are kept between processes
+        self.index_cache = index_cache
+        # archive index -> memory mapped archive shared by all VPKFile views
+        self.archives = {}
+        self._archives_lock = threading.Lock()
 
         self.read_header()
 
@@ -205,42 +658,78 @@ class VPK(object):
             self.read_index()
 
     def __repr__(self):
-        headonly = ', read_header_only=True' if len(self) == 0 else ''
+        headonly = ', read_header_only=True' if self.tree is None else ''
         return "%s('%s'%s)" % (self.__class__.__name__, self.vpk_path, headonly)
 
     def __iter__(self):
-        if self.tree is None:
-            def path_generator():
-                for path, meta in self.read_index_iter():
-                    yield path
-
-            return iter(path_generator())
-        else:
-            return iter(self.tree)
+        return iter(self.get_index())
 
     def items(self):
-        if self.tree is None:
-            tree = self.read_index_iter()
-
-            return tree if sys.version_info >= (3,) else list(tree)
-        else:
-            return self.tree.items()
+        return self.get_index().items()
 
     def __len__(self):
+        return len(self.get_index())
+
+    def get_index(self):
+        """
+        Returns VPKIndex of the archive, the index is read once on first use
+        """
         if self.tree is None:
-            length = 0
-            for _ in self.read_index_iter():
-                length += 1
+            self.read_index()
 
-            return length
-        else:
-            return len(self.tree)
+        return self.tree
+
+    def listdir(self, path=''):
+        """
+        Returns names of files and subdirectories (ending with /) directly in directory path
+        """
+        return self.get_index().listdir(path)
+
+    def iter_prefix(self, prefix):
+        """
+        Yields paths starting with prefix
+        """
+        return self.get_index().iter_prefix(prefix)
+
+    def glob(self, pattern):
+        """
+        Yields paths matching fnmatch style pattern
+        """
+        return self.get_index().glob(pattern)
+
+    def with_extension(self, ext):
+        """
+        Yields paths of files with extension ext
+        """
+        return self.get_index().with_extension(ext)
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        pass
+        self.close()
+
+    def get_archive(self, archive_index):
+        """
+        Returns memory mapped archive, every archive is opened once per VPK instance
+        """
+        archive = self.archives.get(archive_index)
+        if archive is None:
+            with self._archives_lock:
+                archive = self.archives.get(archive_index)
+                if archive is None:
+                    archive = _map_archive(_archive_path(self.vpk_path, archive_index))
+                    self.archives[archive_index] = archive
+        return archive
+
+    def close(self):
+        """
+        Closes pooled archives, VPKFile instances made by this VPK can't be read afterwards
+        """
+        with self._archives_lock:
+            for archive in self.archives.values():
+                archive.close()
+            self.archives.clear()
 
     def __getitem__(self, key):
         """
@@ -248,6 +737,62 @@ class VPK(object):
         """
         return self.get_file(key)
 
+    def extract(self, entries, workers=4, max_gap=2**16, max_read=2**24):
+        """
+        Extracts many files at once, entries is iterable of (metadata, output path)
+
+        Files are grouped by archive and sorted by offset, neighbouring files are read
+        together in a single slice of up to max_read bytes (skipping gaps up to max_gap),
+        and runs are written out by a pool of worker threads.
+        Yields output paths as files are written.
+        """
+        runs = []
+        by_archive = {}
+        for metadata, out_path in entries:
+            if isinstance(metadata, dict):
+                metadata = tuple(metadata[key] for key in _META_KEYS)
+            if metadata[5] == 0:
+                # preload only, nothing to read from archives
+                runs.append((None, 0, 0, [(metadata, out_path)]))
+            else:
+                by_archive.setdefault(metadata[3], []).append((metadata, out_path))
+
+        for archive_index in sorted(by_archive):
+            files = sorted(by_archive[archive_index], key=lambda entry: entry[0][4])
+            run = []
+            run_start = run_end = 0
+            for metadata, out_path in files:
+                start = metadata[4]
+                end = start + metadata[5]
+                if run and (start - run_end > max_gap or end - run_start > max_read):
+                    runs.append((archive_index, run_start, run_end, run))
+                    run = []
+                if not run:
+                    run_start = start
+                run_end = max(run_end, end) if run else end
+                run.append((metadata, out_path))
+            if run:
+                runs.append((archive_index, run_start, run_end, run))
+
+        def write_run(run):
+            archive_index, run_start, run_end, files = run
+            data = b''
+            if archive_index is not None:
+                data = memoryview(self.get_archive(archive_index)[run_start:run_end])
+            written = []
+            for metadata, out_path in files:
+                with fopen(out_path, 'wb') as output:
+                    output.write(metadata[0])
+                    if metadata[5]:
+                        output.write(data[metadata[4] - run_start:metadata[4] - run_start + metadata[5]])
+                written.append(out_path)
+            return written
+
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            for written in pool.map(write_run, runs):
+                for out_path in written:
+                    yield out_path
+
     def get_file(self, path):
         """
         Returns VPKFile instance for the given path
@@ -259,27 +804,20 @@ class VPK(object):
         """
         Returns metadata for given file path
         """
-        if self.tree is None:
-            self.read_index()
-
-        if path not in self.tree:
+        metadata = self.get_index().get(path)
+        if metadata is None:
             raise KeyError("Path doesn't exist")
 
-        return self._make_meta_dict(self.tree[path])
+        return self._make_meta_dict(metadata)
 
     def make_vpkfile(self, path, metadata):
         if isinstance(metadata, tuple):
             metadata = self._make_meta_dict(metadata)
-        return VPKFile(self.vpk_path, filepath=path, **metadata)
+        archive = self.get_archive(metadata['archive_index']) if metadata['file_length'] else None
+        return VPKFile(self.vpk_path, archive=archive, filepath=path, **metadata)
 
     def _make_meta_dict(self, metadata):
-        return dict(zip(['preload',
-                         'crc32',
-                         'preload_length',
-                         'archive_index',
-                         'archive_offset',
-                         'file_length',
-                         ], metadata))
+        return dict(zip(_META_KEYS, metadata))
 
     def read_header(self):
         """
@@ -332,104 +870,229 @@ class VPK(object):
     def calculate_checksums(self):
         assert self.version == 2, "Checksum only work for VPK version 2"
 
-        tree_checksum = md5()
-        chunk_hashes_checksum = md5()
-        file_checksum = md5()
+        tree_start = self.header_length
+        tree_end = tree_start + self.tree_length
+        chunk_hashes_start = tree_end + self.embed_chunk_length
+        chunk_hashes_end = chunk_hashes_start + self.chunk_hashes_length
 
-        def chunk_reader(length, chunk_size=2**14):
-            limit = f.tell() + length
+        # file checksum covers everything up to and including tree and chunk hashes checksums
+        spans = [(tree_start, tree_end),
+                 (chunk_hashes_start, chunk_hashes_end),
+                 (0, chunk_hashes_end + 16*2),
+                 ]
 
-            while f.tell() < limit:
-                yield f.read(min(chunk_size, limit - f.tell()))
+        with memoryview(self.get_archive(0x7fff)) as data:
+            def digest(span):
+                return md5(data[span[0]:span[1]]).digest()
 
-        with fopen(self.vpk_path, 'rb') as f:
-            file_checksum.update(f.read(self.header_length))
+            with ThreadPoolExecutor(len(spans)) as pool:
+                return tuple(pool.map(digest, spans))
+
+    def read_chunk_hashes(self):
+        """
+        Returns list of (archive_index, archive_offset, length, md5 digest) for version 2 archive chunks
+        """
+        assert self.version == 2, "Chunk hashes only exist in VPK version 2"
 
-            for chunk in chunk_reader(self.tree_length):
-                file_checksum.update(chunk)
-                tree_checksum.update(chunk)
+        with fopen(self.vpk_path, 'rb') as f:
+            f.seek(self.header_length + self.tree_length + self.embed_chunk_length)
+            data = f.read(self.chunk_hashes_length)
 
-            for chunk in chunk_reader(self.embed_chunk_length):
-                file_checksum.update(chunk)
+        if len(data) != self.chunk_hashes_length or len(data) % _chunk_hash_struct.size:
+            raise ValueError("Error parsing chunk hashes (out of bounds)")
 
-            for chunk in chunk_reader(self.chunk_hashes_length):
-                file_checksum.update(chunk)
-                chunk_hashes_checksum.update(chunk)
+        return list(_chunk_hash_struct.iter_unpack(data))
 
-            file_checksum.update(f.read(16*2))
+    def verify(self, workers=4, progress=None, batch_size=2**24):
+        """
+        Verifies CRC32 of every file and, for version 2, the directory checksums and MD5 of every archive chunk
 
-        return tree_checksum.digest(), chunk_hashes_checksum.digest(), file_checksum.digest()
+        Archives are memory mapped and checked in batches of about batch_size bytes
+        on a pool of worker threads. progress(done, total) is called with byte counts after every batch.
+        Returns sorted list of failures as (name, reason), name is file path or archive:offset of a chunk
+        """
+        failures = []
+        batches = []
+
+        def add_batches(check, by_archive):
+            for archive_index in sorted(by_archive, key=lambda index: (index is None, index)):
+                items = sorted(by_archive[archive_index], key=lambda item: item[0])
+                batch = []
+                nbytes = 0
+                for item in items:
+                    batch.append(item)
+                    nbytes += item[1]
+                    if nbytes >= batch_size:
+                        batches.append((check, archive_index, batch, nbytes))
+                        batch = []
+                        nbytes = 0
+                if batch:
+                    batches.append((check, archive_index, batch, nbytes))
+
+        files = {}
+        for path, metadata in self.items():
+            preload, checksum, _, archive_index, archive_offset, file_length = metadata
+            if file_length == 0:
+                # preload only, nothing to read from archives
+                archive_index = None
+            files.setdefault(archive_index, []).append((archive_offset, file_length, path, preload, checksum))
+
+        def check_files(archive, name, batch):
+            failed = []
+            for archive_offset, file_length, path, preload, checksum in batch:
+                value = crc32(preload)
+                if file_length:
+                    value = crc32(archive[archive_offset:archive_offset+file_length], value)
+                if value & 0xffffffff != checksum:
+                    failed.append((path, "CRC32 mismatch"))
+            return failed
+
+        add_batches(check_files, files)
+
+        if self.version == 2:
+            checksums = self.calculate_checksums()
+            for name, expected, value in (("tree", self.tree_checksum, checksums[0]),
+                                          ("chunk hashes", self.chunk_hashes_checksum, checksums[1]),
+                                          ("file", self.file_checksum, checksums[2])):
+                if expected != value:
+                    failures.append((self.vpk_path, "%s MD5 mismatch" % name))
+
+            chunks = {}
+            for archive_index, archive_offset, length, digest in self.read_chunk_hashes():
+                chunks.setdefault(archive_index, []).append((archive_offset, length, digest))
+
+            def check_chunks(archive, name, batch):
+                failed = []
+                for archive_offset, length, digest in batch:
+                    if md5(archive[archive_offset:archive_offset+length]).digest() != digest:
+                        failed.append(("%s:%d" % (name, archive_offset), "MD5 mismatch"))
+                return failed
+
+            add_batches(check_chunks, chunks)
+
+        def run(batch):
+            check, archive_index, items, nbytes = batch
+            if archive_index is None:
+                return nbytes, check(None, None, items)
+
+            name = os.path.basename(_archive_path(self.vpk_path, archive_index))
+            try:
+                archive = self.get_archive(archive_index)
+            except (IOError, OSError, ValueError):
+                return nbytes, [(name, "missing archive")]
+
+            # slices of memoryview are hashed in place, without copying out of the mapping
+            with memoryview(archive) as view:
+                return nbytes, check(view, name, items)
+
+        total = sum(batch[3] for batch in batches)
+        done = 0
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            for future in as_completed([pool.submit(run, batch) for batch in batches]):
+                nbytes, failed = future.result()
+                failures.extend(failed)
+                done += nbytes
+                if progress is not None:
+                    progress(done, total)
+
+        return sorted(set(failures))
 
     def read_index(self):
         """
         Reads the index and populates the directory tree
         """
-        if not isinstance(self.tree, dict):
-            self.tree = dict()
-
-        self.tree.clear()
+        if self.index_cache is None:
+            self.tree = VPKIndex.from_tree(self.read_tree(), self.header_length + self.tree_length)
+            return
 
-        for path, metadata in self.read_index_iter():
-            self.tree[path] = metadata
+        tree = None if self.version == 2 else self.read_tree()
+        key = self.index_key(tree)
+        cache_path = self.index_cache_path()
 
-    def read_index_iter(self):
-        """Generator function that reads the file index from the vpk file
+        try:
+            self.tree = VPKIndex.load(cache_path, key)
+            return
+        except (IOError, OSError, ValueError):
+            pass
+
+        if tree is None:
+            tree = self.read_tree()
+        self.tree = VPKIndex.from_tree(tree, self.header_length + self.tree_length)
+
+        try:
+            if not os.path.isdir(self.index_cache):
+                os.makedirs(self.index_cache)
+            self.tree.save(cache_path, key)
+        except (IOError, OSError):
+            # cache is only an optimization
+            pass
+
+    def index_key(self, tree=None):
+        """
+        Returns (size, mtime, tree checksum) identifying the current state of the _dir.vpk
 
-        yeilds (file_path, metadata)
+        VPK v2 stores the tree checksum in its header, for v1 the tree is hashed
         """
+        stat = os.stat(self.vpk_path)
+        if self.version == 2:
+            checksum = self.tree_checksum
+        else:
+            checksum = md5(self.read_tree() if tree is None else tree).digest()
+        return stat.st_size, stat.st_mtime_ns, checksum
+
+    def index_cache_path(self):
+        name = md5(os.path.abspath(self.vpk_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.index_cache, name + '.vpkindex')
 
+    def read_tree(self):
+        """
+        Returns the raw directory tree, read with a single call
+        """
         with fopen(self.vpk_path, 'rb') as f:
             f.seek(self.header_length)
+            tree = f.read(self.tree_length)
 
-            while True:
-                if self.version > 0 and f.tell() > self.tree_length + self.header_length:
-                    raise ValueError("Error parsing index (out of bounds)")
+        if len(tree) != self.tree_length:
+            raise ValueError("Error parsing index (out of bounds)")
 
-                ext = _read_cstring(f)
-                if ext == '':
-                    break
+        return tree
 
-                while True:
-                    path = _read_cstring(f)
-                    if path == '':
-                        break
-                    if path != ' ':
-                        path += '/'
-                    else:
-                        path = ''
-
-                    while True:
-                        name = _read_cstring(f)
-                        if name == '':
-                            break
-
-                        (crc32,
+    def read_index_iter(self):
+        """Generator function that reads the file index from the vpk file
+
+        yeilds (file_path, metadata)
+        """
+        tree = self.read_tree()
+
+        for (path,
+             crc32,
+             preload_offset,
+             preload_length,
+             archive_index,
+             archive_offset,
+             file_length,
+             ) in _iter_tree(tree, self.header_length + self.tree_length):
+            yield path, (tree[preload_offset:preload_offset+preload_length],
+                         crc32,
                          preload_length,
                          archive_index,
                          archive_offset,
                          file_length,
-                         suffix,
-                         ) = metadata = list(struct.unpack("IHHIIH", f.read(18)))
-
-                        if suffix != 0xffff:
-                            raise ValueError("Error while parsing index")
-
-                        if archive_index == 0x7fff:
-                            metadata[3] = self.header_length + self.tree_length + archive_offset
-
-                        metadata = (f.read(preload_length),) + tuple(metadata[:-1])
+                         )
 
-                        yield "{0}{1}.{2}".format(path, name, ext), metadata
 
-
-class VPKFile(FileIO):
+class VPKFile(io.RawIOBase):
     """
     Wrapper class for files with VPK
 
-    Should act like a regular file object. No garantees
+    Lightweight read-only view of the file: preload bytes from the directory
+    followed by a slice of the memory mapped archive. Behaves as a seekable raw binary stream,
+    reads and line searches work directly on the mapping, so no extra buffering is needed
     """
 
-    def __init__(self, vpk_path, **kw):
+    def __init__(self, vpk_path, archive=None, **kw):
+        super(VPKFile, self).__init__()
+
         self.vpk_path = vpk_path
         self.vpk_meta = kw
 
@@ -443,49 +1106,51 @@ class VPKFile(FileIO):
         self.length = self.preload_length + self.file_length
         # offset of entire file
         self.offset = 0
+        self.name = None
+        self.archive = None
+        self._owns_archive = False
 
         if self.file_length == 0:
             self.vpk_path = None
             return
 
-        super(VPKFile, self).__init__(vpk_path.replace("dir.", "%03d." % self.archive_index), 'rb')
-        super(VPKFile, self).seek(self.archive_offset)
+        self.name = _archive_path(vpk_path, self.archive_index)
+
+        # archive is normally shared from VPK pool, a standalone VPKFile maps it on its own
+        if archive is None:
+            archive = _map_archive(self.name)
+            self._owns_archive = True
+        self.archive = archive
 
     def save(self, path):
         """
         Save the file to the specified path
         """
-        # remember and restore file position
-        pos = self.tell()
-        self.seek(0)
-
         with fopen(path, 'wb') as output:
-            output.truncate(self.length)
-            for chunk in iter(lambda: self.read(1024), b''):
+            for chunk in self.iter_chunks():
                 output.write(chunk)
 
-        self.seek(pos)
-
     def verify(self):
         """
         Returns True if the file contents match with the CRC32 attribute
-
-        note: reset
         """
-
-        # remember file pointer
-        pos = self.tell()
-        self.seek(0)
-
         checksum = 0
-        for chunk in iter(lambda: self.read(1024), b''):
+        for chunk in self.iter_chunks():
             checksum = crc32(chunk, checksum)
 
-        # restore file pointer
-        self.seek(pos)
-
         return self.crc32 == checksum & 0xffffffff
 
+    def iter_chunks(self, chunk_size=2**20):
+        """
+        Yields entire file content in chunks, file position is not affected
+        """
+        if self.preload_length:
+            yield self.preload
+
+        end = self.archive_offset + self.file_length
+        for start in range(self.archive_offset, end, chunk_size):
+            yield self.archive[start:min(start + chunk_size, end)]
+
     def __repr__(self):
         return "%s(%s, %s)" % (
             self.__class__.__name__,
@@ -493,74 +1158,128 @@ class VPKFile(FileIO):
             ', '.join(["%s=%s" % (k, repr(v)) for k, v in self.vpk_meta.items()])
             )
 
-    def __enter__(self):
-        return self
-
-    def __exit__(self, type, value, traceback):
-        self.close()
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return self.next()
-
-    def next(self):
-        line = self.readline()
-        if line == b'':
-            raise StopIteration
-        return line
-
     def close(self):
+        if self._owns_archive and self.archive is not None:
+            self.archive.close()
+        self.archive = None
         super(VPKFile, self).close()
 
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
     def tell(self):
         return self.offset
 
-    def seek(self, offset):
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.offset
+        elif whence == io.SEEK_END:
+            offset += self.length
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence (%s)" % repr(whence))
+
         if offset < 0:
             raise IOError("Invalid argument")
 
         self.offset = offset
-        if self.file_length > 0:
-            super(VPKFile, self).seek(self.archive_offset + max(offset - self.preload_length, 0))
+        return offset
 
-    def readlines(self):
-        return [line for line in self]
+    def _slice(self, start, end):
+        """
+        Returns file bytes from start to end, a single slice unless the range spans preload and archive data
+        """
+        if end <= self.preload_length:
+            return self.preload[start:end]
 
-    def readline(self, a=False):
-        buf = b''
+        archive_start = self.archive_offset + max(start - self.preload_length, 0)
+        data = self.archive[archive_start:self.archive_offset + end - self.preload_length]
 
-        for chunk in iter(lambda: self.read(256), b''):
-            pos = chunk.find(b'\n')
-            if pos > -1:
-                pos += 1  # include \n
-                buf += chunk[:pos]
-                self.seek(self.offset - (len(chunk) - pos))
-                break
+        if start < self.preload_length:
+            return b''.join((self.preload[start:], data))
+        return data
 
-            buf += chunk
+    def _end(self, length):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
 
-        return buf
+        if length is None or length < 0:
+            return self.length
+        return min(self.offset + length, self.length)
 
     def read(self, length=-1):
-        if length == 0 or self.offset >= self.length:
+        end = self._end(length)
+        if end <= self.offset:
             return b''
 
-        data = b''
+        data = self._slice(self.offset, end)
+        self.offset = end
 
-        if self.offset <= self.preload_length:
-            data += self.preload[self.offset:self.offset+length if length > -1 else None]
-            self.offset += len(data)
-            if length > 0:
-                length = max(length - len(data), 0)
+        return data
 
-        if self.file_length > 0 and self.offset >= self.preload_length:
-            left = self.file_length - (self.offset - self.preload_length)
-            data += super(VPKFile, self).read(left if length == -1 else min(left, length))
-            self.offset += left if length == -1 else min(left, length)
+    def readall(self):
+        return self.read()
 
-        return data
+    def readinto(self, buffer):
+        """
+        Reads up to len(buffer) bytes directly into writable buffer, returns number of bytes read
+        """
+        with memoryview(buffer) as target:
+            target = target.cast('B')
+            end = self._end(len(target))
+            if end <= self.offset:
+                return 0
+
+            pos = 0
+            if self.offset < self.preload_length:
+                part = min(end, self.preload_length) - self.offset
+                target[:part] = self.preload[self.offset:self.offset + part]
+                pos = part
+
+            if end > self.preload_length:
+                archive_start = self.archive_offset + max(self.offset - self.preload_length, 0)
+                archive_end = self.archive_offset + end - self.preload_length
+                with memoryview(self.archive) as source:
+                    target[pos:pos + archive_end - archive_start] = source[archive_start:archive_end]
+
+        length = end - self.offset
+        self.offset = end
+
+        return length
+
+    def readline(self, size=-1):
+        """
+        Returns bytes up to and including the next newline, line end is searched for in place
+        """
+        end = self._end(size)
+        offset = self.offset
+        if end <= offset:
+            return b''
+
+        if offset >= self.preload_length:
+            # common case, the rest of the file is in the archive
+            base = self.archive_offset - self.preload_length
+            line_end = self.archive.find(b'\n', offset + base, end + base)
+            if line_end != -1:
+                end = line_end - base + 1
+            self.offset = end
+            return self.archive[offset + base:end + base]
+
+        line_end = -1
+        if self.offset < self.preload_length:
+            line_end = self.preload.find(b'\n', self.offset, min(end, self.preload_length))
+        if line_end == -1 and end > self.preload_length:
+            start = self.archive_offset + max(self.offset - self.preload_length, 0)
+            line_end = self.archive.find(b'\n', start, self.archive_offset + end - self.preload_length)
+            if line_end != -1:
+                line_end += self.preload_length - self.archive_offset
+
+        if line_end != -1:
+            end = line_end + 1
+
+        return self.read(end - self.offset)
 
     def write(self, seq):
         raise NotImplementedError("write method is not supported")
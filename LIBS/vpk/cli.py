@@ -10,6 +10,7 @@ from fnmatch import fnmatch
 import argparse
 from binascii import hexlify
 import os
+import time
 
 import vpk
 
@@ -26,8 +27,10 @@ def make_argparser():
     excl.add_argument('-la', dest='listall', action='store_true', help='List file paths, crc, size')
     excl.add_argument('-x', '--extract', dest='out_location', type=str, help='Exctract files to directory')
     info.add_argument('-nd', '--no-directories', dest='makedir', action='store_false', help="Don't create directries during extraction")
+    info.add_argument('-j', '--jobs', dest='workers', type=int, default=4, help='Number of threads used for extraction, verification and creation')
     excl.add_argument('-t', '--test', action='store_true', help='Verify contents')
     excl.add_argument('-c', '--create', metavar='DIR', type=str, help='Create VPK file from directory')
+    info.add_argument('-s', '--archive-size', dest='archive_size', metavar='BYTES', type=int, help='Split created VPK into numbered archives of up to this size')
 
     filtr = parser.add_argument_group('Filters')
     fexcl = filtr.add_mutually_exclusive_group()
@@ -81,11 +84,30 @@ def make_filter_func(wildcard=None, name_wildcard=None, regex=None):
     return path_filter
 
 
-def print_file_list(pak, match_filter=None, include_details=False):
-    for path, metadata in pak.read_index_iter():
-        if match_filter and not match_filter(path):
-            continue
+def find_files(pak, wildcard=None, name_wildcard=None, regex=None):
+    """
+    Yields (path, metadata) of matching files, wildcard and extension queries are answered from the sorted index
 
+    Index queries are case sensitive, so they are only used where fnmatch is too (it folds case on Windows)
+    """
+    index = pak.get_index()
+    case_sensitive = os.path.normcase('A') == 'A'
+
+    if wildcard and case_sensitive:
+        paths = index.glob(wildcard)
+    elif name_wildcard and case_sensitive and re.match(r'^\*\.[^*?\[/.]+$', name_wildcard):
+        # single extension only, '*.dx90.vtx' has to match whole file name
+        paths = index.with_extension(name_wildcard[2:])
+    else:
+        path_filter = make_filter_func(wildcard, name_wildcard, regex)
+        paths = index if path_filter is None else filter(path_filter, index)
+
+    for path in paths:
+        yield path, index[path]
+
+
+def print_file_list(files, include_details=False):
+    for path, metadata in files:
         crc = metadata[1]
         file_size = metadata[5]
 
@@ -95,13 +117,22 @@ def print_file_list(pak, match_filter=None, include_details=False):
             print(path)
 
 
-def print_verifcation(pak):
-    for path, metadata in pak.read_index_iter():
-        with pak.make_vpkfile(path, metadata) as vpkfile:
-            ok = vpkfile.verify()
+def print_verifcation(pak, workers=4):
+    start = time.time()
+
+    def progress(done, total):
+        elapsed = max(time.time() - start, 1e-6)
+        sys.stderr.write("\r%3d%% %s / %s bytes, %.1f MB/s" % (
+            100 * done // max(total, 1), "{:,}".format(done), "{:,}".format(total), done / elapsed / 2**20))
+        sys.stderr.flush()
 
-            if not ok:
-                print("%s: FAILED" % path)
+    failures = pak.verify(workers=workers, progress=progress)
+    sys.stderr.write("\n")
+
+    for name, reason in failures:
+        print("%s: FAILED (%s)" % (name, reason))
+
+    print("Verified in %.2fs, %s" % (time.time() - start, "%d failures" % len(failures) if failures else "OK"))
 
 
 def mktree(path):
@@ -114,14 +145,11 @@ def mktree(path):
         os.makedirs(path)
 
 
-def extract_files(pak, match_filter, outdir, makedir=False):
+def extract_files(pak, files, outdir, makedir=False, workers=4):
     outdir = os.path.relpath(outdir)
 
-    for path, metadata in pak.read_index_iter():
-        if match_filter and not match_filter(path):
-            continue
-
-        with pak.make_vpkfile(path, metadata) as vpkfile:
+    def entries():
+        for path, metadata in files:
             if makedir:
                 outpath = os.path.join(outdir, path)
             else:
@@ -129,18 +157,19 @@ def extract_files(pak, match_filter, outdir, makedir=False):
 
             mktree(outpath)
 
-            vpkfile.save(outpath)
+            yield metadata, outpath
 
-            print(outpath)
+    for outpath in pak.extract(entries(), workers=workers):
+        print(outpath)
 
 
-def create_vpk(directory, outpath):
+def create_vpk(directory, outpath, archive_size=None, workers=4):
     if not os.path.exists(directory):
         raise IOError("path doesn't exist: %s" % repr(directory))
     if not os.path.isdir(directory):
         raise IOError("not a directory: %s" % repr(directory))
 
-    vpk.new(directory).save(outpath)
+    vpk.new(directory).save(outpath, archive_size=archive_size, workers=workers)
 
 
 def main():
@@ -157,19 +186,18 @@ def main():
 
     try:
         if args.create:
-            create_vpk(args.create, args.file)
+            create_vpk(args.create, args.file, args.archive_size, args.workers)
             return
 
         pak = vpk.open(args.file)
 
-        path_filter = make_filter_func(args.filter, args.filter_name, args.regex)
-
         if args.list or args.listall:
-            print_file_list(pak, path_filter, args.listall)
+            print_file_list(find_files(pak, args.filter, args.filter_name, args.regex), args.listall)
         elif args.test:
-            print_verifcation(pak)
+            print_verifcation(pak, args.workers)
         elif args.out_location:
-            extract_files(pak, path_filter, args.out_location, args.makedir)
+            files = find_files(pak, args.filter, args.filter_name, args.regex)
+            extract_files(pak, files, args.out_location, args.makedir, args.workers)
         else:
             print_header(pak)
 
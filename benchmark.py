@@ -0,0 +1,219 @@
+"""
+Headless benchmarks for BSPreader and the geometry pipeline, doesn't need blender.
+
+Usage:
+    python benchmark.py map.bsp [map2.bsp ...] [-o results.json] [--repeat 3] [--compare old.json]
+
+Every benchmark is repeated and the best time is reported together with throughput,
+peak python memory is measured by one more traced run.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from BSP_DATA import *
+import BSP_reader
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def close_reader(reader):
+    # mapping stays alive while decoded arrays reference it, it is released together with them
+    reader.finish()
+    reader.file.close()
+
+
+def measure(func, repeat):
+    """
+    Calls func repeat times untraced and once more under tracemalloc,
+    returns best untraced time, peak traced memory and value returned by last call.
+    func has to return (elapsed time, value), so it can leave its own setup out of the timing.
+    Tracing slows python code down several times, so it is kept out of the timed calls.
+    """
+    best = None
+    for _ in range(repeat):
+        elapsed, value = func()
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, value
+
+
+def result(name, mode, elapsed, peak, nbytes=0, count=None, unit='items'):
+    return {
+        'name': name,
+        'mode': mode,
+        'time': elapsed,
+        'bytes': nbytes,
+        'mb_per_s': nbytes / elapsed / (1024 * 1024) if nbytes and elapsed else None,
+        'count': count,
+        'unit': unit,
+        'per_s': count / elapsed if count and elapsed else None,
+        'peak_memory': peak,
+    }
+
+
+MODES = {
+    'objects': {},
+    'arrays': {'use_mmap': True, 'use_arrays': True},
+}
+
+
+def bench_header(path, repeat):
+    def run():
+        start = time.perf_counter()
+        reader = BSP_reader.BSPreader(path)
+        elapsed = time.perf_counter() - start
+        close_reader(reader)
+        return elapsed, None
+
+    elapsed, peak, _ = measure(run, repeat)
+    return [result('header', 'objects', elapsed, peak, 8 + HEADER_LUMPS * 16 + 4)]
+
+
+def bench_lumps(path, mode, repeat):
+    results = []
+    for lump_id in sorted(BSP_reader.BSPreader.LUMP_READERS):
+        def run():
+            reader = BSP_reader.BSPreader(path, **MODES[mode])
+            # time includes lumps decoded on demand from inside the reader (texdata reads string table)
+            start = time.perf_counter()
+            value = reader.BSP.LUMPS[lump_id]
+            elapsed = time.perf_counter() - start
+            nbytes = reader.BSP.lump_t[lump_id].filelen
+            close_reader(reader)
+            return elapsed, (nbytes, len(value) if hasattr(value, '__len__') else None)
+
+        elapsed, peak, (nbytes, count) = measure(run, repeat)
+        results.append(result(LUMP_ENUM(lump_id).name, mode, elapsed, peak, nbytes, count, 'records'))
+    return results
+
+
+def bench_full(path, mode, repeat):
+    def run():
+        start = time.perf_counter()
+        reader = BSP_reader.BSPreader(path, lazy=False, **MODES[mode])
+        elapsed = time.perf_counter() - start
+        faces = len(reader.BSP.LUMPS[LUMP_ENUM.LUMP_FACES])
+        close_reader(reader)
+        return elapsed, faces
+
+    elapsed, peak, faces = measure(run, repeat)
+    return [result('full', mode, elapsed, peak, os.path.getsize(path), faces, 'faces')]
+
+
+def bench_polygons(path, repeat):
+    reader = BSP_reader.BSPreader(path, **MODES['arrays'])
+    faces = reader.BSP.LUMPS[LUMP_ENUM.LUMP_FACES]  # type: FaceTable
+    surfedges = reader.BSP.LUMPS[LUMP_ENUM.LUMP_SURFEDGES]
+    edges = reader.BSP.LUMPS[LUMP_ENUM.LUMP_EDGES]
+
+    def run():
+        start = time.perf_counter()
+        polygons = faces.polygons(surfedges, edges)
+        return time.perf_counter() - start, len(polygons)
+
+    try:
+        elapsed, peak, count = measure(run, repeat)
+    finally:
+        close_reader(reader)
+    # every face edge reads one surfedge and one edge
+    nbytes = int(faces.numedges.sum()) * (np.dtype(Surfedge.dtype).itemsize + np.dtype(dedge_t.dtype).itemsize)
+    return [result('polygons', 'arrays', elapsed, peak, nbytes, count, 'faces')]
+
+
+def bench_map(path, repeat):
+    reader = BSP_reader.BSPreader(path)
+    version = reader.BSP.version
+    close_reader(reader)
+    results = bench_header(path, repeat)
+    modes = ['objects'] + (['arrays'] if np is not None else [])
+    for mode in modes:
+        results += bench_lumps(path, mode, repeat)
+        results += bench_full(path, mode, repeat)
+    if np is not None:
+        results += bench_polygons(path, repeat)
+    return {
+        'file': os.path.abspath(path),
+        'size': os.path.getsize(path),
+        'version': version,
+        'results': results,
+    }
+
+
+def run(paths, repeat=3):
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'numpy': np.__version__ if np is not None else None,
+        'repeat': repeat,
+        'maps': [bench_map(path, repeat) for path in paths],
+    }
+
+
+def compare(old, new):
+    """Yields (map, name, mode, old time, new time) for benchmarks present in both reports"""
+    old_maps = {os.path.basename(m['file']): m for m in old['maps']}
+    for new_map in new['maps']:
+        old_map = old_maps.get(os.path.basename(new_map['file']))
+        if old_map is None:
+            continue
+        old_results = {(r['name'], r['mode']): r for r in old_map['results']}
+        for r in new_map['results']:
+            old_r = old_results.get((r['name'], r['mode']))
+            if old_r is not None:
+                yield os.path.basename(new_map['file']), r['name'], r['mode'], old_r['time'], r['time']
+
+
+def print_report(report):
+    for bsp in report['maps']:
+        print('{} (v{}, {:.1f} MB)'.format(bsp['file'], bsp['version'], bsp['size'] / (1024 * 1024)))
+        for r in bsp['results']:
+            line = '  {:<32} {:<8} {:>10.4f}s {:>10.1f} KB peak'.format(r['name'], r['mode'], r['time'],
+                                                                      r['peak_memory'] / 1024)
+            if r['mb_per_s'] is not None:
+                line += ' {:>10.1f} MB/s'.format(r['mb_per_s'])
+            if r['per_s'] is not None:
+                line += ' {:>12.0f} {}/s'.format(r['per_s'], r['unit'])
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark BSPreader on given maps')
+    parser.add_argument('maps', nargs='+', help='BSP files to benchmark')
+    parser.add_argument('-o', '--output', help='write results to this JSON file')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='repetitions per benchmark, best is kept')
+    parser.add_argument('-c', '--compare', help='previous JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    report = run(args.maps, args.repeat)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print('Compared to', args.compare)
+        for name, bench, mode, old_time, new_time in compare(old, report):
+            print('  {:<20} {:<32} {:<8} {:>10.4f}s -> {:>10.4f}s {:>+7.1f}%'.format(
+                name, bench, mode, old_time, new_time, (new_time - old_time) / old_time * 100 if old_time else 0))
+
+
+if __name__ == '__main__':
+    main()
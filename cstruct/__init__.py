@@ -106,9 +106,15 @@ import re
 import struct
 import sys
 
+try:
+    import numpy
+except ImportError: # numpy is optional, only needed for __dtype__ and view_array
+    numpy = None
+
 __all__ = ['LITTLE_ENDIAN',
            'BIG_ENDIAN',
            'CStruct',
+           'CStructArray',
            'define',
            'typedef',
           ]
@@ -142,6 +148,22 @@ C_TYPE_TO_FORMAT = {
     'uint64':               'L',
 }
 
+# struct format character -> numpy type (standard sizes)
+NUMPY_TYPES = {
+    'b':                    'i1',
+    'B':                    'u1',
+    'h':                    'i2',
+    'H':                    'u2',
+    'i':                    'i4',
+    'I':                    'u4',
+    'l':                    'i4',
+    'L':                    'u4',
+    'q':                    'i8',
+    'Q':                    'u8',
+    'f':                    'f4',
+    'd':                    'f8',
+}
+
 STRUCTS = {
 }
 
@@ -182,6 +204,7 @@ class CStructMeta(type):
                 dict['__fmt__'] = '=' + dict['__fmt__']
 
             dict['__size__'] = struct.calcsize(dict['__fmt__'])
+            dict['__dtype__'] = mcs.parse_dtype(dict['__fmt__'][0], dict['__fields__'], dict['__fields_types__'])
         new_class = type.__new__(mcs, name, bases, dict)
         if __struct__ is not None:
             STRUCTS[name] = new_class
@@ -263,6 +286,29 @@ class CStructMeta(type):
         fmt = "".join(fmt)
         return fmt, fields, fields_types
 
+    @staticmethod
+    def parse_dtype(byte_order, fields, fields_types):
+        # numpy dtype with the same layout as the struct format string
+        if numpy is None:
+            return None
+        dtype = []
+        for field in fields:
+            (vtype, vlen) = fields_types[field]
+            if vtype == 'char': # string
+                dtype.append((field, 'S%d' % vlen))
+            elif isinstance(vtype, CStructMeta):
+                if vtype.__dtype__ is None:
+                    return None
+                num = int(vlen / vtype.size)
+                dtype.append((field, vtype.__dtype__) if num == 1 else (field, vtype.__dtype__, (num,)))
+            else:
+                ttype = C_TYPE_TO_FORMAT[vtype]
+                if ttype == 'P': # pointers have no standard size
+                    return None
+                ttype = byte_order + NUMPY_TYPES[ttype]
+                dtype.append((field, ttype) if vlen == 1 else (field, ttype, (vlen,)))
+        return numpy.dtype(dtype)
+
     def __len__(cls):
         return cls.__size__
 
@@ -292,6 +338,7 @@ class CStruct(_CStructParent):
     __size__ = lenght of the structure in bytes
     __fields__ = list of structure fields
     __fields_types__ = dictionary mapping field names to types
+    __dtype__ = numpy dtype with the same layout (None if numpy is not available)
     Every fields defined in the structure is added to the class
 
     """
@@ -302,6 +349,60 @@ class CStruct(_CStructParent):
         for key, value in kargs.items():
             setattr(self, key, value)
 
+    @classmethod
+    def unpack_array(cls, string, count=None):
+        """
+        Unpack the string containing count consecutive packed C structures
+        (as many as fit if count is None) into a CStructArray table.
+        Columns are numpy arrays viewing string when numpy dtype is available,
+        tuples of unpacked values otherwise
+        """
+        size = cls.__size__
+        if count is None:
+            count = len(string) // size
+        if cls.__dtype__ is not None:
+            return CStructArray.from_records(cls, cls.view_array(string, count))
+        flat = list(zip(*struct.iter_unpack(cls.__fmt__, string[:count * size])))
+        if not flat:
+            flat = [()] * len(struct.unpack(cls.__fmt__, b'\0' * size))
+        columns = {}
+        list_fields = []
+        i = 0
+        for field in cls.__fields__:
+            (vtype, vlen) = cls.__fields_types__[field]
+            if vtype == 'char': # string
+                columns[field] = flat[i]
+                i = i + 1
+            elif isinstance(vtype, CStructMeta):
+                num = int(vlen / vtype.size)
+                raw = EMPTY_BYTES_STRING.join([EMPTY_BYTES_STRING.join(item) for item in zip(*flat[i:i+vlen])])
+                sub_structs = vtype.unpack_array(raw, count * num)
+                if num == 1: # single struct
+                    columns[field] = sub_structs
+                else: # multiple struct
+                    columns[field] = [[sub_structs[j * num + k] for k in range(num)] for j in range(count)]
+                i = i + vlen
+            elif vlen == 1:
+                columns[field] = flat[i]
+                i = i + vlen
+            else:
+                columns[field] = list(zip(*flat[i:i+vlen]))
+                list_fields.append(field)
+                i = i + vlen
+        return CStructArray(cls, columns, range(count), list_fields)
+
+    @classmethod
+    def view_array(cls, string, count=None):
+        """
+        Returns numpy structured array (dtype __dtype__) viewing count packed
+        C structures in string without copying (as many as fit if count is None)
+        """
+        if cls.__dtype__ is None:
+            raise TypeError("numpy dtype is not available for " + cls.__name__)
+        if count is None:
+            count = len(string) // cls.__size__
+        return numpy.frombuffer(string, cls.__dtype__, count)
+
     def unpack(self, string):
         """
         Unpack the string containing packed C structure data
@@ -395,3 +496,100 @@ class CStruct(_CStructParent):
     def __repr__(self):
         return self.__str__()
 
+
+class CStructArray(object):
+    """
+    Column oriented table of unpacked C structures, created by CStruct.unpack_array.
+
+    Every field is stored once as a column (numpy array or tuple of values), structure
+    instances (rows) are only created when they are accessed by index or iteration.
+    Slicing returns a table view sharing the same columns.
+    Rows are new objects on every access, changes made to them are not stored in the table.
+    """
+
+    def __init__(self, struct_class, columns, index, list_fields=()):
+        self.struct_class = struct_class
+        self.columns = columns
+        self.index = index
+        self.list_fields = list_fields
+
+    @classmethod
+    def from_records(cls, struct_class, records):
+        """
+        Creates table with numpy columns from structured array of struct_class records (dtype __dtype__)
+        """
+        columns = {}
+        for field in struct_class.__fields__:
+            (vtype, vlen) = struct_class.__fields_types__[field]
+            column = records[field]
+            if vtype == 'char': # string, void keeps trailing null bytes as struct does
+                columns[field] = column.view('V%d' % vlen)
+            elif isinstance(vtype, CStructMeta):
+                num = int(vlen / vtype.size)
+                if num == 1: # single struct
+                    columns[field] = cls.from_records(vtype, column)
+                else: # multiple struct
+                    sub_structs = cls.from_records(vtype, column.reshape(-1))
+                    columns[field] = [[sub_structs[j * num + k] for k in range(num)] for j in range(len(records))]
+            else:
+                columns[field] = column
+        return cls(struct_class, columns, range(len(records)))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return CStructArray(self.struct_class, self.columns, self.index[item], self.list_fields)
+        return self.row(self.index[item])
+
+    def __iter__(self):
+        fields = list(self.columns)
+        values = [self._values(field) for field in fields]
+        for row_values in zip(*values):
+            row = self.struct_class.__new__(self.struct_class)
+            row.__dict__.update(zip(fields, row_values))
+            yield row
+
+    def _slice(self):
+        # index is a range, slicing keeps numpy columns from being copied
+        stop = self.index.stop
+        return slice(self.index.start, stop if stop >= 0 else None, self.index.step)
+
+    def _values(self, field):
+        # python values of field for all rows of this table
+        column = self.columns[field]
+        if numpy is not None and isinstance(column, numpy.ndarray):
+            return column[self._slice()].tolist()
+        if isinstance(column, CStructArray):
+            return list(CStructArray(column.struct_class, column.columns, column.index[self._slice()],
+                                     column.list_fields))
+        if field in self.list_fields:
+            return [list(value) for value in column[self._slice()]]
+        return column[self._slice()]
+
+    def column(self, field):
+        """
+        Returns list of field values for all rows of this table
+        """
+        return list(self._values(field))
+
+    def row(self, j):
+        """
+        Returns structure instance for row j of the underlying columns
+        """
+        row = self.struct_class.__new__(self.struct_class)
+        values = row.__dict__
+        for field, column in self.columns.items():
+            if isinstance(column, CStructArray):
+                values[field] = column.row(j)
+            elif numpy is not None and isinstance(column, numpy.ndarray):
+                values[field] = column[j].tolist()
+            elif field in self.list_fields:
+                values[field] = list(column[j])
+            else:
+                values[field] = column[j]
+        return row
+
+    def __repr__(self):
+        return "%s(%s, %d rows)" % (type(self).__name__, self.struct_class.__name__, len(self))
@@ -0,0 +1,175 @@
+import glob
+import os
+import threading
+
+from LIBS.KeyValue_parser import token_regex
+from vfs import VirtualFileSystem
+
+GAMEINFO_PATH = '|gameinfo_path|'
+ALL_SOURCE_ENGINE_PATHS = '|all_source_engine_paths|'
+
+
+def parse_keyvalues(text):
+    """
+    Parses KeyValues text (gameinfo.txt syntax) into list of (key, value) pairs,
+    value is string or list of pairs for nested block. Comments and platform conditionals are skipped.
+    Tokens come from the entity lump tokenizer, so backslashes in quoted paths are plain characters.
+    """
+    root = []
+    stack = [root]
+    key = None
+    for match in token_regex.finditer(text):
+        quoted, brace, bare = match.groups()
+        if brace == '{':
+            block = []
+            stack[-1].append((key if key is not None else '', block))
+            stack.append(block)
+            key = None
+        elif brace == '}':
+            if len(stack) > 1:
+                stack.pop()
+            key = None
+        elif quoted is not None or bare is not None:
+            token = quoted if quoted is not None else bare
+            if key is None:
+                key = token
+            else:
+                stack[-1].append((key, token))
+                key = None
+    return root
+
+
+def find_block(pairs, *names):
+    """Returns nested block by case-insensitive key path or None"""
+    for name in names:
+        for key, value in pairs:
+            if key.lower() == name.lower() and isinstance(value, list):
+                pairs = value
+                break
+        else:
+            return None
+    return pairs
+
+
+class SearchPath:
+    """Single SearchPaths entry, ids is set of lowercase path ids (game, mod, platform...)"""
+    __slots__ = ('ids', 'path', 'raw')
+
+    def __init__(self, ids, path, raw):
+        self.ids = ids
+        self.path = path
+        self.raw = raw
+
+    def __repr__(self):
+        return 'SearchPath({}, {!r})'.format('+'.join(sorted(self.ids)), self.path)
+
+    @property
+    def is_vpk(self):
+        return self.path.lower().endswith('.vpk')
+
+    def resolve(self):
+        """
+        Returns existing directories or *_dir.vpk files this entry stands for.
+        VPK entries are written without _dir suffix, both kinds can contain wildcards (custom/*).
+        """
+        if not self.is_vpk:
+            if glob.has_magic(self.path):
+                return sorted(path for path in glob.glob(self.path) if os.path.isdir(path))
+            return [self.path] if os.path.isdir(self.path) else []
+        pattern = self.path[:-4]
+        if not pattern.lower().endswith('_dir'):
+            pattern += '_dir'
+        pattern += '.vpk'
+        if glob.has_magic(pattern):
+            return sorted(glob.glob(pattern))
+        return [pattern] if os.path.isfile(pattern) else []
+
+
+class GameInfo:
+    """
+    Parsed gameinfo.txt with search paths resolved to absolute normalized paths.
+    Instances are shared by load(), use it instead of constructing directly.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.normpath(os.path.abspath(path))
+        # |gameinfo_path| is mod directory, |all_source_engine_paths| and plain relative paths are its parent
+        self.root = os.path.dirname(self.path)
+        self.base = os.path.dirname(self.root)
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            self.keyvalues = parse_keyvalues(f.read())
+        gameinfo = find_block(self.keyvalues, 'GameInfo') or self.keyvalues
+        self.game = next((value for key, value in gameinfo if key.lower() == 'game' and isinstance(value, str)), '')
+        self.search_paths = []
+        for key, value in find_block(gameinfo, 'FileSystem', 'SearchPaths') or []:
+            if isinstance(value, str):
+                self.search_paths.append(SearchPath(set(key.lower().split('+')), self.expand(value), value))
+        self._lock = threading.RLock()
+        self._resolved = {}
+        self._filesystem = None
+
+    def __repr__(self):
+        return 'GameInfo({!r}, {} search paths)'.format(self.path, len(self.search_paths))
+
+    def expand(self, path):
+        path = path.replace('\\', '/')
+        if path.lower().startswith(GAMEINFO_PATH):
+            path = os.path.join(self.root, path[len(GAMEINFO_PATH):])
+        elif path.lower().startswith(ALL_SOURCE_ENGINE_PATHS):
+            path = os.path.join(self.base, path[len(ALL_SOURCE_ENGINE_PATHS):])
+        elif not os.path.isabs(path):
+            path = os.path.join(self.base, path)
+        return os.path.normpath(path)
+
+    def paths(self, path_id='game'):
+        """Returns existing directories and VPK files for path id in priority order, resolved once"""
+        with self._lock:
+            if path_id not in self._resolved:
+                paths = []
+                for search_path in self.search_paths:
+                    if path_id in search_path.ids:
+                        for path in search_path.resolve():
+                            if path not in paths:
+                                paths.append(path)
+                self._resolved[path_id] = paths
+            return self._resolved[path_id]
+
+    def filesystem(self, index_cache=None):
+        """
+        Returns VirtualFileSystem with all game search paths mounted, it is built once and shared.
+        VPK indexes are kept in index_cache directory between processes, it is used by the call that builds filesystem.
+        """
+        with self._lock:
+            if self._filesystem is None:
+                fs = VirtualFileSystem(index_cache=index_cache)
+                for path in self.paths('game'):
+                    fs.mount_search_path(path)
+                self._filesystem = fs
+            return self._filesystem
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load(path):
+    """
+    Returns GameInfo for gameinfo.txt or directory containing it.
+    Result is memoized per file (and its modification time), so all maps of one game share it.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'gameinfo.txt')
+    path = os.path.normpath(os.path.abspath(path))
+    mtime = os.path.getmtime(path)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        gameinfo = GameInfo(path)
+        _cache[path] = (mtime, gameinfo)
+        return gameinfo
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
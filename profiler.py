@@ -0,0 +1,90 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Opt-in instrumentation for reader and importer steps.
+    Every measured step records wall time, bytes read, element count and memory allocated by python (tracemalloc).
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.steps = []
+        # nesting level of currently measured step
+        self._depth = 0
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.start_time = time.perf_counter()
+
+    def _memory(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()
+        return 0, 0
+
+    @contextmanager
+    def measure(self, name, nbytes=0, **info):
+        """
+        Measures block of code as step called name.
+        Yields step dict, so caller can fill in count (or any other value) once it is known.
+        """
+        depth = self._depth
+        step = {'name': name, 'bytes': nbytes, 'count': None, 'depth': depth}
+        step.update(info)
+        mem_before = self._memory()[0]
+        start = time.perf_counter()
+        self._depth = depth + 1
+        try:
+            yield step
+        finally:
+            self._depth = depth
+            step['time'] = time.perf_counter() - start
+            current, peak = self._memory()
+            step['memory'] = current - mem_before
+            step['peak_memory'] = peak
+            self.steps.append(step)
+
+    def report(self):
+        """Returns all measured steps and totals as json-serializable dict"""
+        steps = self.steps
+        top = [step for step in steps if step['depth'] == 0]
+        return {
+            'wall_time': time.perf_counter() - self.start_time,
+            'time': sum(step['time'] for step in top),
+            'bytes': sum(step['bytes'] for step in steps),
+            'peak_memory': self._memory()[1],
+            'steps': steps,
+        }
+
+    def to_json(self, path=None, **kwargs):
+        """Returns report as json string, also writes it to path if given"""
+        text = json.dumps(self.report(), indent=kwargs.pop('indent', 2), **kwargs)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def close(self):
+        """Stops tracemalloc if it was started by this profiler"""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+class NullProfiler:
+    """Profiler replacement that measures nothing, used when instrumentation is off"""
+    steps = ()
+
+    @contextmanager
+    def measure(self, name, nbytes=0, **info):
+        yield {}
+
+    def report(self):
+        return {}
+
+    def close(self):
+        pass
@@ -0,0 +1,26 @@
+import os
+
+import gameinfo
+
+
+def test_directory_wildcard_search_path(tmp_path):
+    mod = tmp_path / 'mod'
+    for name in ('a', 'b'):
+        (mod / 'custom' / name).mkdir(parents=True)
+    (mod / 'custom' / 'readme.txt').write_text('')
+    (mod / 'gameinfo.txt').write_text('"GameInfo"\n{\n game "x"\n FileSystem\n {\n SearchPaths\n {\n'
+                                      ' game |gameinfo_path|custom/*\n game |gameinfo_path|.\n }\n }\n}\n')
+
+    paths = gameinfo.GameInfo(str(mod / 'gameinfo.txt')).paths('game')
+    assert paths == [os.path.join(str(mod), 'custom', 'a'), os.path.join(str(mod), 'custom', 'b'), str(mod)]
+
+
+def test_backslash_search_path(tmp_path):
+    mod = tmp_path / 'mod'
+    (mod / 'custom').mkdir(parents=True)
+    (mod / 'gameinfo.txt').write_text('"GameInfo"\n{\n game "x"\n FileSystem\n {\n SearchPaths\n {\n'
+                                      ' game "|gameinfo_path|custom\\" [$WIN32]\n game "|gameinfo_path|."\n'
+                                      ' }\n }\n}\n')
+
+    paths = gameinfo.GameInfo(str(mod / 'gameinfo.txt')).paths('game')
+    assert paths == [os.path.join(str(mod), 'custom'), str(mod)]
@@ -0,0 +1,11 @@
+from LIBS import KeyValue_parser
+
+
+def test_trailing_backslash_value():
+    text = ('{\n"classname" "prop_static"\n"model" "models\\props\\"\n"origin" "1 2 3"\n}\n'
+            '{\n"classname" "info_target"\n"targetname" "a { b } // c"\n}\n')
+    entities = list(KeyValue_parser.iter_entities(text))
+    assert entities == [
+        {'classname': 'prop_static', 'model': 'models\\props\\', 'origin': [1.0, 2.0, 3.0]},
+        {'classname': 'info_target', 'targetname': 'a { b } // c'},
+    ]
@@ -0,0 +1,50 @@
+import io
+import zipfile
+
+from LIBS import vpk
+import vfs
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def test_layer_priority(tmp_path):
+    content = tmp_path / 'content'
+    write(content / 'materials' / 'a.vmt', b'vpk a')
+    write(content / 'materials' / 'b.vmt', b'vpk b')
+    (tmp_path / 'game').mkdir()
+    vpk.new(str(content)).save(str(tmp_path / 'game' / 'pak01_dir.vpk'))
+    # loose file next to pak01 is shadowed by it, others are found on disk
+    write(tmp_path / 'game' / 'materials' / 'B.vmt', b'loose b')
+    write(tmp_path / 'game' / 'materials' / 'c.vmt', b'loose c')
+
+    game = vfs.VirtualFileSystem()
+    game.mount_search_path(str(tmp_path / 'game'))
+    layer, location = game.find('materials/a.vmt')
+    assert layer.kind == 'VPK' and location == 'materials/a.vmt'
+    assert game.open('MATERIALS\\b.vmt').read() == b'vpk b'
+    assert game.find('materials/c.vmt')[0].kind == 'FILE'
+    assert 'materials/d.vmt' not in game
+
+    pak = io.BytesIO()
+    with zipfile.ZipFile(pak, 'w') as zip_file:
+        zip_file.writestr('materials/A.vmt', b'pak a')
+    fs = vfs.VirtualFileSystem(game)
+    fs.mount_pak(zipfile.ZipFile(pak))
+    assert fs.open('materials/a.vmt').read() == b'pak a'
+    assert fs.open('materials/c.vmt').read() == b'loose c'
+
+
+def test_vpk_index_cache(tmp_path):
+    write(tmp_path / 'content' / 'models' / 'm.mdl', b'mdl')
+    (tmp_path / 'game').mkdir()
+    vpk.new(str(tmp_path / 'content')).save(str(tmp_path / 'game' / 'pak01_dir.vpk'))
+    index_cache = tmp_path / 'index'
+
+    for _ in range(2):
+        fs = vfs.VirtualFileSystem(index_cache=str(index_cache))
+        fs.mount_search_path(str(tmp_path / 'game'))
+        assert fs.open('models/m.mdl').read() == b'mdl'
+        assert len(list(index_cache.iterdir())) == 1
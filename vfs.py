@@ -0,0 +1,168 @@
+import os
+
+from LIBS import vpk
+
+
+def normalize_path(path):
+    """Index key of path: forward slashes, lowercase, no leading ./ or /"""
+    path = path.replace('\\', '/').lower()
+    while path.startswith('./'):
+        path = path[2:]
+    return path.lstrip('/')
+
+
+class PakLayer:
+    """Files embedded into map pak lump (zipfile.ZipFile)"""
+    kind = 'PAK'
+
+    def __init__(self, zip_file, name='pak'):
+        self.zip_file = zip_file
+        self.path = name
+        # normalized path -> member name
+        self.index = {}
+        for info in zip_file.infolist():
+            if not info.filename.endswith('/'):
+                self.index.setdefault(normalize_path(info.filename), info.filename)
+
+    def __len__(self):
+        return len(self.index)
+
+    def find(self, key):
+        return self.index.get(key)
+
+    def open(self, location):
+        return self.zip_file.open(location, 'r')
+
+
+class VPKLayer:
+    """
+    Files inside VPK archive, path points to *_dir.vpk file.
+    Lookups go straight to the sorted VPK index, VPK stores paths in lower case like normalize_path.
+    Parsed index is kept in index_cache directory between processes when it is given.
+    """
+    kind = 'VPK'
+
+    def __init__(self, path, index_cache=None):
+        self.path = path
+        self.vpk = vpk.open(path, read_header_only=False, index_cache=index_cache)
+
+    def __len__(self):
+        return len(self.vpk)
+
+    def find(self, key):
+        return key if self.vpk.get_index().find(key) != -1 else None
+
+    def open(self, location):
+        return self.vpk.get_file(location)
+
+
+class DirectoryLayer:
+    """Loose files under game directory, listed once at mount time"""
+    kind = 'FILE'
+
+    def __init__(self, path):
+        self.path = path
+        # normalized path -> path on disk
+        self.index = {}
+        for root, _, files in os.walk(path):
+            rel = os.path.relpath(root, path)
+            for name in files:
+                key = normalize_path(name if rel == '.' else rel + '/' + name)
+                self.index.setdefault(key, os.path.join(root, name))
+
+    def __len__(self):
+        return len(self.index)
+
+    def find(self, key):
+        return self.index.get(key)
+
+    def open(self, location):
+        return open(location, 'rb')
+
+
+class VirtualFileSystem:
+    """
+    Layered view over map pak, VPK archives and loose directories.
+    Every layer indexes its files once at mount time (VPK layers use the index of the archive itself),
+    so lookup is one case-insensitive index access per layer instead of stat call per search path.
+    Layers are mounted from highest to lowest priority, the first layer that has the file wins.
+    Files not found in own layers are looked up in parent filesystem, so game content
+    can be mounted once and shared by every map.
+    """
+
+    def __init__(self, parent=None, index_cache=None):
+        self.parent = parent
+        # directory of persistent VPK indexes, see vpk.VPK
+        self.index_cache = index_cache
+        self.layers = []
+        # archives and directories already mounted, engine mounts pak01 of search path implicitly
+        # so it can also be listed explicitly in gameinfo
+        self.mounted = set()
+
+    def __repr__(self):
+        return '{}({} layers)'.format(self.__class__.__name__, len(self.layers))
+
+    def __contains__(self, path):
+        return self.find(path) is not None
+
+    def mount(self, layer):
+        self.layers.append(layer)
+        return layer
+
+    def mount_pak(self, zip_file, name='pak'):
+        return self.mount(PakLayer(zip_file, name))
+
+    def mount_vpk(self, path):
+        if not self._claim(path):
+            return None
+        return self.mount(VPKLayer(path, self.index_cache))
+
+    def mount_directory(self, path):
+        if not self._claim(path):
+            return None
+        return self.mount(DirectoryLayer(path))
+
+    def _claim(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        if key in self.mounted:
+            return False
+        self.mounted.add(key)
+        return True
+
+    def mount_search_path(self, path):
+        """
+        Mounts game search path the way engine does: pak01_dir.vpk found in directory
+        takes priority over loose files next to it. Path can also point directly to *_dir.vpk file.
+        """
+        if path.lower().endswith('.vpk'):
+            if os.path.isfile(path):
+                self.mount_vpk(path)
+            return
+        if not os.path.isdir(path):
+            return
+        pak01 = os.path.join(path, 'pak01_dir.vpk')
+        if os.path.isfile(pak01):
+            self.mount_vpk(pak01)
+        self.mount_directory(path)
+
+    def find(self, path):
+        """Returns (layer, location) of file or None if it isn't mounted"""
+        return self.lookup(normalize_path(path))
+
+    def lookup(self, key):
+        """find() for already normalized path"""
+        for layer in self.layers:
+            location = layer.find(key)
+            if location is not None:
+                return layer, location
+        if self.parent is not None:
+            return self.parent.lookup(key)
+        return None
+
+    def open(self, path):
+        """Opens file for binary reading from highest priority layer that has it"""
+        found = self.find(path)
+        if found is None:
+            raise FileNotFoundError(path)
+        layer, location = found
+        return layer.open(location)